@@ -0,0 +1,38 @@
+"""Benchmarks for DPD learning and crest factor reduction"""
+import numpy as np
+
+from phypy.analog import PowerAmp
+from phypy.corrections import ILA_DPD, CFR
+from phypy.modulators import OFDM
+
+
+class ILALearning:
+    params = ([10**3, 10**5, 10**7], [3, 7], [1, 4])
+    param_names = ['n_samples', 'order', 'memory_depth']
+    timeout = 600
+
+    def setup(self, n_samples, order, memory_depth):
+        rng = np.random.RandomState(0)
+        self.x = (rng.randn(n_samples) + 1j*rng.randn(n_samples)) / 4
+        self.pa = PowerAmp(noise_variance=0, add_iq_imbalance=False, add_lo_leakage=False)
+        self.order = order
+        self.memory_depth = memory_depth
+
+    def time_perform_learning(self, n_samples, order, memory_depth):
+        ILA_DPD(order=order, memory_depth=memory_depth).perform_learning(self.pa, self.x)
+
+    def peakmem_perform_learning(self, n_samples, order, memory_depth):
+        ILA_DPD(order=order, memory_depth=memory_depth).perform_learning(self.pa, self.x)
+
+
+class CrestFactorReduction:
+    params = ([14, 140], [2, 8])
+    param_names = ['n_symbols', 'n_iterations']
+
+    def setup(self, n_symbols, n_iterations):
+        self.ofdm = OFDM(n_subcarriers=1200)
+        self.x = self.ofdm.use(n_symbols)
+        self.cfr = CFR(self.ofdm, n_iterations=n_iterations)
+
+    def time_process(self, n_symbols, n_iterations):
+        self.cfr.process(self.x)
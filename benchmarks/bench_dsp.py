@@ -0,0 +1,21 @@
+"""Benchmarks for the DSP helpers"""
+import numpy as np
+
+from phypy import dsp
+
+
+class FrequencyShift:
+    params = [10**3, 10**5, 10**7]
+    param_names = ['n_samples']
+
+    def setup(self, n_samples):
+        self.x = np.ones(n_samples, dtype=np.complex64)
+
+    def time_frequency_shift(self, n_samples):
+        dsp.frequency_shift(self.x, 1e6, 30.72e6)
+
+    def time_nco_in_place(self, n_samples):
+        dsp.NCO(1e6, 30.72e6).mix(self.x, out=self.x)
+
+    def peakmem_frequency_shift(self, n_samples):
+        dsp.frequency_shift(self.x, 1e6, 30.72e6)
@@ -0,0 +1,66 @@
+"""Benchmarks for the OFDM modulator and demodulator"""
+import numpy as np
+
+from phypy.modulators import OFDM
+
+
+class OFDMSuite:
+    # 5, 10, and 20 MHz LTE
+    params = ([300, 600, 1200], [14, 140, 1400])
+    param_names = ['n_subcarriers', 'n_symbols']
+
+    def setup(self, n_subcarriers, n_symbols):
+        self.ofdm = OFDM(n_subcarriers=n_subcarriers)
+        self.x = self.ofdm.use(n_symbols)
+
+    def time_use(self, n_subcarriers, n_symbols):
+        self.ofdm.use(n_symbols)
+
+    def time_demodulate(self, n_subcarriers, n_symbols):
+        self.ofdm.demodulate(self.x)
+
+    def peakmem_use(self, n_subcarriers, n_symbols):
+        self.ofdm.use(n_symbols)
+
+    def peakmem_demodulate(self, n_subcarriers, n_symbols):
+        self.ofdm.demodulate(self.x)
+
+
+class ReceiveSuite:
+    params = (['QPSK', '16QAM', '64QAM'], [1, 16])
+    param_names = ['constellation', 'n_frames']
+
+    def setup(self, constellation, n_frames):
+        self.ofdm = OFDM(n_subcarriers=1200, constellation=constellation)
+        frame = self.ofdm.use(14)
+        self.frames = np.tile(frame, (n_frames, 1))
+        self.received = self.ofdm.receive(self.frames)
+        self.reference = np.broadcast_to(self.ofdm.fd_symbols, self.received.shape)
+
+    def time_receive(self, constellation, n_frames):
+        self.ofdm.receive(self.frames)
+
+    def time_demap(self, constellation, n_frames):
+        self.ofdm.demap(self.received)
+
+    def time_demap_llr(self, constellation, n_frames):
+        self.ofdm.demap_llr(self.received, 0.01)
+
+    def time_link_metrics(self, constellation, n_frames):
+        self.ofdm.link_metrics(self.reference, self.received)
+
+
+class BitMappingSuite:
+    params = (['QPSK', '16QAM', '64QAM'], [2**17, 2**20])
+    param_names = ['constellation', 'n_bytes']
+
+    def setup(self, constellation, n_bytes):
+        self.ofdm = OFDM(n_subcarriers=1200, constellation=constellation)
+        self.payload = np.random.default_rng(0).integers(0, 256, size=n_bytes, dtype=np.uint8)
+        self.fd_symbols = self.ofdm.bits_to_symbols(self.payload)
+
+    def time_bits_to_symbols(self, constellation, n_bytes):
+        self.ofdm.bits_to_symbols(self.payload)
+
+    def time_symbols_to_bytes(self, constellation, n_bytes):
+        self.ofdm.symbols_to_bytes(self.fd_symbols, n_bytes)
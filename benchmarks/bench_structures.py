@@ -0,0 +1,147 @@
+"""Benchmarks for the memory polynomial
+
+Run with asv, or directly with ``python -m benchmarks.bench_structures`` from the repo root to print
+the speedup of the current implementation over the original per-column loop.
+"""
+import numpy as np
+
+from phypy.structures import MemoryPolynomial, GainLookupTable
+
+SIGNAL_LENGTHS = [10**3, 10**5, 10**7]
+ORDERS = [3, 7]
+MEMORY_DEPTHS = [1, 4]
+
+
+def reference_basis_matrix(poly, x):
+    """The original setup_basis_matrix loop. Kept here as the baseline for the speedup"""
+    X = np.zeros((x.size, poly.n_coeffs), dtype=np.complex64)
+    column_index = 0
+    for order in range(1, poly.order + 1, 2):
+        branch = np.multiply(x, np.power(np.abs(x), (order - 1)))
+        for tap in range(0, poly.memory_depth):
+            delay = tap * poly.memory_stride
+            X[:, column_index] = np.resize(np.insert(branch, 0, np.zeros(delay)), branch.size)
+            column_index += 1
+    return X
+
+
+class MemoryPolynomialSuite:
+    params = (SIGNAL_LENGTHS, ORDERS, MEMORY_DEPTHS)
+    param_names = ['n_samples', 'order', 'memory_depth']
+    timeout = 300
+
+    def setup(self, n_samples, order, memory_depth):
+        rng = np.random.RandomState(0)
+        self.x = (rng.randn(n_samples) + 1j*rng.randn(n_samples)) / 4
+        self.poly = MemoryPolynomial(order=order, memory_depth=memory_depth)
+        self.poly.coeffs = rng.randn(*self.poly.coeffs.shape) + 1j*rng.randn(*self.poly.coeffs.shape)
+        self.y = self.poly.transmit(self.x)
+
+
+class BasisMatrix(MemoryPolynomialSuite):
+    def setup(self, n_samples, order, memory_depth):
+        super().setup(n_samples, order, memory_depth)
+        self.out = np.empty((n_samples, self.poly.n_coeffs), dtype=np.complex64, order='F')
+
+    def time_setup_basis_matrix(self, n_samples, order, memory_depth):
+        self.poly.setup_basis_matrix(self.x)
+
+    def time_setup_basis_matrix_with_buffer(self, n_samples, order, memory_depth):
+        self.poly.setup_basis_matrix(self.x, out=self.out)
+
+    def time_reference_basis_matrix(self, n_samples, order, memory_depth):
+        reference_basis_matrix(self.poly, self.x)
+
+    def peakmem_setup_basis_matrix(self, n_samples, order, memory_depth):
+        self.poly.setup_basis_matrix(self.x)
+
+
+class Transmit(MemoryPolynomialSuite):
+    def time_transmit(self, n_samples, order, memory_depth):
+        self.poly.transmit(self.x)
+
+    def time_basis_matrix_product(self, n_samples, order, memory_depth):
+        np.dot(self.poly.setup_basis_matrix(self.x), self.poly.coeffs.flatten())
+
+    def time_transmit_stream(self, n_samples, order, memory_depth):
+        for _ in self.poly.transmit_stream(self.x, block_size=65536):
+            pass
+
+    def peakmem_transmit(self, n_samples, order, memory_depth):
+        self.poly.transmit(self.x)
+
+    def peakmem_transmit_stream(self, n_samples, order, memory_depth):
+        for _ in self.poly.transmit_stream(self.x, block_size=65536):
+            pass
+
+
+class LeastSquares(MemoryPolynomialSuite):
+    def time_perform_least_squares(self, n_samples, order, memory_depth):
+        self.poly.perform_least_squares(self.x, self.y)
+
+    def peakmem_perform_least_squares(self, n_samples, order, memory_depth):
+        self.poly.perform_least_squares(self.x, self.y)
+
+
+class BasisFamilies:
+    """Transmit and least squares cost of each basis family at the same order and memory depth"""
+    params = [[10**5], ['odd', 'full', 'orthogonal']]
+    param_names = ['n_samples', 'basis']
+
+    def setup(self, n_samples, basis):
+        rng = np.random.RandomState(0)
+        self.x = (rng.randn(n_samples) + 1j*rng.randn(n_samples)) / 4
+        self.poly = MemoryPolynomial(order=7, memory_depth=4, basis=basis)
+        self.poly.coeffs = rng.randn(*self.poly.coeffs.shape) + 1j*rng.randn(*self.poly.coeffs.shape)
+        self.y = self.poly.transmit(self.x)
+
+    def time_transmit(self, n_samples, basis):
+        self.poly.transmit(self.x)
+
+    def time_perform_least_squares(self, n_samples, basis):
+        self.poly.perform_least_squares(self.x, self.y)
+
+
+class LookupTable(MemoryPolynomialSuite):
+    """Apply cost of the compiled gain tables, which should not grow with the order"""
+    def setup(self, n_samples, order, memory_depth):
+        super().setup(n_samples, order, memory_depth)
+        self.lut = GainLookupTable(self.poly, n_entries=256, max_amplitude=np.max(np.abs(self.x)))
+
+    def time_lut_transmit(self, n_samples, order, memory_depth):
+        self.lut.transmit(self.x)
+
+    def time_compile_tables(self, n_samples, order, memory_depth):
+        self.lut.compile_tables()
+
+
+if __name__ == "__main__":
+    import timeit
+
+    def best_time(function, n_runs=5):
+        return min(timeit.repeat(function, number=1, repeat=n_runs))
+
+    for n_samples in [10**4, 10**6]:
+        bench = BasisMatrix()
+        bench.setup(n_samples, 7, 4)
+        new = best_time(lambda: bench.time_setup_basis_matrix(n_samples, 7, 4))
+        buffered = best_time(lambda: bench.time_setup_basis_matrix_with_buffer(n_samples, 7, 4))
+        old = best_time(lambda: bench.time_reference_basis_matrix(n_samples, 7, 4))
+        print(f'N = {n_samples:>8}: reference {old*1e3:8.2f} ms, new {new*1e3:8.2f} ms, '
+              f'new with buffer {buffered*1e3:8.2f} ms, speedup {old/new:5.1f}x')
+
+    for n_samples in [10**4, 10**6]:
+        bench = Transmit()
+        bench.setup(n_samples, 7, 4)
+        direct = best_time(lambda: bench.time_transmit(n_samples, 7, 4))
+        basis = best_time(lambda: bench.time_basis_matrix_product(n_samples, 7, 4))
+        print(f'N = {n_samples:>8}: basis matrix product {basis*1e3:8.2f} ms, direct transmit {direct*1e3:8.2f} ms, '
+              f'speedup {basis/direct:5.1f}x')
+
+    for order in ORDERS:
+        bench = LookupTable()
+        bench.setup(10**6, order, 4)
+        poly = best_time(lambda: bench.poly.transmit(bench.x))
+        lut = best_time(lambda: bench.time_lut_transmit(10**6, order, 4))
+        print(f'order {order}: polynomial transmit {poly*1e3:8.2f} ms, LUT transmit {lut*1e3:8.2f} ms, '
+              f'speedup {poly/lut:5.1f}x')
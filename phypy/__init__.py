@@ -10,5 +10,9 @@ from . import analog
 from . import corrections
 from . import modulators
 from . import dsp
+from . import waveform_store
+from . import rng
+from . import metrics
 
-__all__ = ['analog', 'corrections', 'modulators', 'dsp', 'structures']
+# sweep needs Python 3.8+ to run, so it is imported on its own with `from phypy import sweep`
+__all__ = ['analog', 'corrections', 'modulators', 'dsp', 'structures', 'waveform_store', 'rng', 'metrics']
@@ -4,8 +4,14 @@
 import numpy as np
 try:
     from .structures import MemoryPolynomial
+    from .dsp import iterate_blocks
+    from .rng import make_seed_sequence, make_rng
+    from .metrics import nmse
 except:
     from structures import MemoryPolynomial
+    from dsp import iterate_blocks
+    from rng import make_seed_sequence, make_rng
+    from metrics import nmse
 
 
 class PowerAmp(MemoryPolynomial):
@@ -13,13 +19,19 @@ class PowerAmp(MemoryPolynomial):
 
     def __init__(self, order: int = 5, memory_depth: int = 4, memory_stride: int = 1,
                  noise_variance: float = 0.05, add_lo_leakage: bool = True,
-                 add_iq_imbalance: bool = True, seed: int = 1):
-        """Creates an instance of a parallel Hammerstein PA model extracted from a WARP PA board"""
+                 add_iq_imbalance: bool = True, seed=1):
+        """Creates an instance of a parallel Hammerstein PA model extracted from a WARP PA board
+
+        The seed may be an int or a np.random.SeedSequence, e.g. one spawned with rng.spawn for
+        each parallel worker. The PA owns its random number generator so it never touches the
+        global np.random state.
+        """
 
         super().__init__(order, memory_depth, memory_stride)
 
         # Seed the random number generator for reproducibility
-        np.random.seed(seed)
+        self.seed_sequence = make_seed_sequence(seed)
+        self.rng = make_rng(self.seed_sequence)
 
         if noise_variance < 0:
             raise Exception("The noisevarriance must be >=0")
@@ -27,7 +39,7 @@ class PowerAmp(MemoryPolynomial):
             self.noise_variance = noise_variance
 
         if add_lo_leakage:
-            self.lo_leakage = 0.01*np.random.randn() + 0.01j*np.random.randn()
+            self.lo_leakage = 0.01*self.rng.standard_normal() + 0.01j*self.rng.standard_normal()
         else:
             self.lo_leakage = 0
 
@@ -52,22 +64,41 @@ class PowerAmp(MemoryPolynomial):
         self.nmse_of_fit = None  # In case we fit the PA to some model
 
     def transmit(self, x):
+        """Transmit a signal, or a 2-D (n_signals, n_samples) batch of signals, through the PA
+
+        Each row of a batch gets its own noise draw and its own memory.
+        """
+        x = self.k1*x + self.k2*np.conj(x)
+        return super().transmit(x) + self.noise_variance*self.rng.random(x.shape)
+
+    def transmit_block(self, x):
         x = self.k1*x + self.k2*np.conj(x)
-        return super().transmit(x) + self.noise_variance*np.random.rand(x.size)
+        return super().transmit_block(x) + self.noise_variance*self.rng.random(x.shape)
+
+    def make_new_model(self, pa_input, pa_output, block_size: int = 65536):
+        """Learn new coefficients based on pa_inputs and pa_outputs
 
-    def make_new_model(self, pa_input, pa_output):
-        """Learn new coefficients based on pa_inputs and pa_outputs"""
-        self.coeffs = self.perform_least_squares(pa_input, pa_output).reshape(self.coeffs.shape)
-        model_pa_output = self.transmit(pa_input)
-        self.nmse_of_fit = self.calculate_nmse(pa_output, model_pa_output)
+        The signals are read block_size samples at a time so they can be memory-mapped
+        captures larger than RAM.
+        """
+        self.coeffs = self.perform_least_squares(pa_input, pa_output, block_size).reshape(self.coeffs.shape)
+
+        error_energy = 0
+        desired_energy = 0
+        self.reset_stream()
+        for x_block, y_block in zip(iterate_blocks(pa_input, block_size), iterate_blocks(pa_output, block_size)):
+            model_pa_output = self.transmit_block(x_block)
+            error_energy += np.linalg.norm(y_block - model_pa_output)**2
+            desired_energy += np.linalg.norm(y_block)**2
+        self.nmse_of_fit = error_energy / desired_energy
 
     @staticmethod
     def calculate_nmse(desired, actual):
-        """Calculate the normalized mean squared error
-        Todo:
-            - Check this. I think I need to divide by number of samples
+        """Calculate the normalized mean squared error over the whole signal or batch
+
+        See metrics.nmse for one value per signal of a batch.
         """
-        return np.linalg.norm(desired-actual)**2 / np.linalg.norm(desired)**2
+        return nmse(desired, actual, axis=None)
 
 
 if __name__ == "__main__":
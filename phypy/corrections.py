@@ -1,9 +1,15 @@
 """Module for performing corrections on impairments related  to the PHY such as DPD"""
+import abc
+
 import numpy as np
 try:
-    from .structures import MemoryPolynomial
+    from .structures import MemoryPolynomial, LeastSquaresAccumulator
+    from .dsp import iterate_blocks
+    from .metrics import papr, ccdf
 except:
-    from structures import MemoryPolynomial
+    from structures import MemoryPolynomial, LeastSquaresAccumulator
+    from dsp import iterate_blocks
+    from metrics import papr, ccdf
 
 
 class ILA_DPD(MemoryPolynomial):
@@ -11,31 +17,220 @@ class ILA_DPD(MemoryPolynomial):
 
     Implements a digital predistorter (DPD) that uses an indirect learning architecture (ILA)
     and a parallel hammerstein, memory polynomial structure that acts as an inverse of the PA model.
+    basis, cross_terms and envelope_scale select the basis family. See MemoryPolynomial.
 
     """
-    def __init__(self, order: int = 5, memory_depth: int = 1, memory_stride: int = 5, n_iterations: int = 2):
+    def __init__(self, order: int = 5, memory_depth: int = 1, memory_stride: int = 5, n_iterations: int = 2,
+                 basis: str = 'odd', cross_terms: int = 0, envelope_scale: float = 1.0):
         self.n_iterations = n_iterations
 
-        super().__init__(order, memory_depth, memory_stride)
+        super().__init__(order, memory_depth, memory_stride, basis=basis, cross_terms=cross_terms,
+                         envelope_scale=envelope_scale)
 
         # Make the 1st coeff 1 to have a completely linear DPD with 0 effect
         self.coeffs = np.zeros(shape=(self.n_rows, self.memory_depth))
         self.coeffs[0, 0] = 1
 
+    def perform_learning(self, pa, signal, block_size: int = 65536):
+        """Learn a new DPD model for a given pa
+
+        The signal is streamed through the predistorter and PA block_size samples at a time, so
+        it can be a memory-mapped capture larger than RAM.
+        """
+        for _ in range(self.n_iterations):
+            accumulator = LeastSquaresAccumulator(self.n_coeffs)
+            postdistorter_state = None
+            input_energy = 0
+            output_energy = 0
+            self.reset_stream()
+            pa.reset_stream()
+            for block in iterate_blocks(signal, block_size):
+                # Forward through the predistorter
+                pa_input = self.transmit_block(block)
+
+                # Transmit the predistorted signal through the actual PA
+                pa_output = pa.transmit_block(pa_input)
+                input_energy += np.vdot(pa_input, pa_input).real
+                output_energy += np.vdot(pa_output, pa_output).real
+
+                # Learn on the postdistorter
+                X = self.setup_basis_matrix(pa_output, initial_state=postdistorter_state, monomial=True)
+                postdistorter_state = self.carry_state(postdistorter_state, pa_output)
+                accumulator.update(X, pa_input)
+
+            # Remove any PA Gain. Scaling the PA output by g scales each order k monomial by g^k.
+            # The transform also maps the monomial normal equations onto the basis family.
+            gain = np.sqrt(input_energy / output_energy)
+            accumulator.transform_columns(self.gain_transform(gain))
+            self.coeffs = accumulator.solve(self.regularization, self.active_columns).reshape(self.coeffs.shape)
+
+
+class AdaptiveILA_DPD(ILA_DPD, abc.ABC):
+    """ILA DPD whose postdistorter is adapted online while the signal streams through the PA
+
+    The signal is processed in blocks. Each block is predistorted with the current coeffs, sent
+    through the PA, and the postdistorter basis of the PA output is used to update the coeffs
+    before the next block. Subclasses implement the update rule in adapt. basis, cross_terms and
+    envelope_scale select the basis family like for ILA_DPD.
+
+    The PA gain is removed with exponentially weighted input and output energies, so the gain
+    estimate follows a drifting PA. Each past sample is discounted by forgetting_factor per new sample.
+    """
+    def __init__(self, order: int = 5, memory_depth: int = 1, memory_stride: int = 5, n_iterations: int = 1,
+                 block_size: int = 1024, forgetting_factor: float = 0.999, basis: str = 'odd',
+                 cross_terms: int = 0, envelope_scale: float = 1.0):
+        super().__init__(order, memory_depth, memory_stride, n_iterations, basis=basis, cross_terms=cross_terms,
+                         envelope_scale=envelope_scale)
+        if not 0 < forgetting_factor <= 1:
+            raise Exception("The forgetting factor must be in (0, 1]")
+        self.coeffs = self.coeffs.astype(np.complex128)
+        self.block_size = block_size
+        self.forgetting_factor = forgetting_factor
+        self.postdistorter_state = None  # Past PA output samples for the postdistorter basis
+        self.input_energy = 0  # Exponentially weighted energies used to remove the PA gain
+        self.output_energy = 0
+
     def perform_learning(self, pa, signal):
-        """Learn a new DPD model for a given pa"""
+        """Adapt the DPD for a given pa by streaming the signal n_iterations times"""
         for _ in range(self.n_iterations):
-            # Forward through the predistorter
-            pa_input = self.transmit(signal)
+            self.reset_stream()
+            pa.reset_stream()
+            self.postdistorter_state = None
+            for block in iterate_blocks(signal, self.block_size):
+                self.learn_block(pa, block)
+
+    def learn_block(self, pa, signal_block):
+        """Predistort one block, send it through the pa, and update the coeffs from the result"""
+        pa_input = self.transmit_block(signal_block)
+        pa_output = pa.transmit_block(pa_input)
+
+        # Remove any PA Gain
+        weights = self.sample_weights(pa_input.size)
+        decay = self.forgetting_factor**pa_input.size
+        self.input_energy = decay*self.input_energy + np.dot(weights, np.abs(pa_input)**2)
+        self.output_energy = decay*self.output_energy + np.dot(weights, np.abs(pa_output)**2)
+        if self.output_energy > 0:
+            pa_output = pa_output*np.sqrt(self.input_energy/self.output_energy)
+
+        # Adapt the postdistorter
+        X = self.setup_basis_matrix(pa_output, initial_state=self.postdistorter_state)
+        self.postdistorter_state = self.carry_state(self.postdistorter_state, pa_output)
+        if self.active_columns is not None:
+            X[..., ~self.active_columns] = 0  # Pruned columns must stay at 0
+        coeffs = self.adapt(X, pa_input, self.coeffs.flatten())
+        self.coeffs = coeffs.reshape(self.coeffs.shape)
 
-            # Transmit the predistorted signal through the actual PA
-            pa_output = pa.transmit(pa_input)
+    def sample_weights(self, n_samples: int):
+        """Weight of each sample of a block at the end of the block, forgetting_factor^(n_samples-1-n)"""
+        return self.forgetting_factor**np.arange(n_samples - 1, -1, -1)
 
-            # Remove any PA Gain
-            pa_output = pa_output*np.linalg.norm(pa_input)/np.linalg.norm(pa_output)
+    @abc.abstractmethod
+    def adapt(self, X, desired, coeffs):
+        """Return updated flattened coeffs given basis rows X and the desired output"""
+
+
+class RLS_DPD(AdaptiveILA_DPD):
+    """Adaptive ILA DPD using exponentially weighted recursive least squares
+
+    RLS gives the coeffs that minimize the error weighted by forgetting_factor^(age of the sample)
+    plus a delta*forgetting_factor^n ridge term. Only the coeffs at the end of each block are used,
+    so each block updates the weighted normal equations in one O(B*K^2) GEMM and solves them with
+    one O(K^3) Cholesky factorization. For block sizes of at least K that is O(K^2) per sample,
+    like sample-by-sample RLS, without the Python loop over samples. The forgetting factor also
+    discounts the energies used to remove the PA gain.
+    """
+    def __init__(self, order: int = 5, memory_depth: int = 1, memory_stride: int = 5, n_iterations: int = 1,
+                 block_size: int = 1024, forgetting_factor: float = 0.999, delta: float = 0.01,
+                 basis: str = 'odd', cross_terms: int = 0, envelope_scale: float = 1.0):
+        super().__init__(order, memory_depth, memory_stride, n_iterations, block_size, forgetting_factor,
+                         basis=basis, cross_terms=cross_terms, envelope_scale=envelope_scale)
+        # Exponentially weighted normal equations of the basis, started from delta*I
+        self.accumulator = LeastSquaresAccumulator(self.n_coeffs)
+        self.accumulator.gram += delta * np.identity(self.n_coeffs)
+
+    def adapt(self, X, desired, coeffs):
+        n_samples = X.shape[0]
+        root_weights = np.sqrt(self.sample_weights(n_samples))
+        self.accumulator.scale(self.forgetting_factor**n_samples)
+        self.accumulator.update(X * root_weights[:, np.newaxis], desired * root_weights)
+        return self.accumulator.solve(active_columns=self.active_columns)
+
+
+class NLMS_DPD(AdaptiveILA_DPD):
+    """Adaptive ILA DPD using block normalized least mean squares
+
+    Each block is one vectorized O(B*K) update so per-sample cost is O(K). With a block size of
+    1 this is the usual sample-by-sample NLMS. forgetting_factor only discounts the energies used
+    to remove the PA gain.
+    """
+    def __init__(self, order: int = 5, memory_depth: int = 1, memory_stride: int = 5, n_iterations: int = 1,
+                 block_size: int = 64, step_size: float = 0.5, epsilon: float = 1e-6,
+                 forgetting_factor: float = 0.999, basis: str = 'odd', cross_terms: int = 0,
+                 envelope_scale: float = 1.0):
+        super().__init__(order, memory_depth, memory_stride, n_iterations, block_size, forgetting_factor,
+                         basis=basis, cross_terms=cross_terms, envelope_scale=envelope_scale)
+        if not 0 < step_size < 2:
+            raise Exception("The NLMS step size must be in (0, 2)")
+        self.step_size = step_size
+        self.epsilon = epsilon
+
+    def adapt(self, X, desired, coeffs):
+        error = desired - np.dot(X, coeffs)
+        energy = np.vdot(X, X).real
+        return coeffs + self.step_size * np.dot(X.conj().T, error) / (self.epsilon + energy)
+
+
+class CFR:
+    """Crest factor reduction by iterative clipping and filtering on the OFDM grid
+
+    Every OFDM symbol of every signal is processed at once. Each iteration clips the time-domain
+    symbols to a magnitude target_papr dB above the signal's RMS level and then filters the
+    clipping noise back onto the occupied subcarriers with one FFT/IFFT pair, which removes the
+    out-of-band regrowth. The iteration count is fixed so the cost is known up front.
+
+    Attributes:
+        ofdm: The OFDM modulator that made the signals. Gives the FFT, subcarrier mapping, and
+            symbol framing.
+        target_papr: Clipping level in dB above the RMS level
+        n_iterations: Number of clip and filter iterations
+        ccdf_thresholds: Power ratios in dB at which process evaluates the CCDF
+    """
+
+    def __init__(self, ofdm, target_papr: float = 7.0, n_iterations: int = 4):
+        self.ofdm = ofdm
+        self.target_papr = target_papr
+        self.n_iterations = n_iterations
+        self.ccdf_thresholds = np.arange(0, 13, 0.5)
+
+    def process(self, x):
+        """Reduce the PAPR of OFDM signals
+
+        Args:
+            x: Time-domain OFDM signal, or signals along the last axis, of whole symbols with
+                cyclic prefixes as made by OFDM.use
+
+        Returns:
+            (signals, papr, ccdf) with the CFR output in the shape of x, its PAPR in dB, and its
+            CCDF at ccdf_thresholds
+        """
+        fd_grid = self.ofdm.receive(x).swapaxes(-2, -1)
+        clip_level = np.sqrt(np.mean(np.abs(x)**2, axis=-1)) * 10**(self.target_papr / 20)
+        clip_level = clip_level[..., np.newaxis, np.newaxis]
+
+        spectrum = np.zeros(fd_grid.shape[:-1] + (self.ofdm.fft_size,), dtype=np.complex128)
+        for _ in range(self.n_iterations):
+            spectrum[..., self.ofdm.subcarrier_bins] = fd_grid
+            td_grid = self.ofdm.fft.ifft(spectrum, axis=-1)
+            magnitude = np.abs(td_grid)
+            td_grid *= np.minimum(1, clip_level / np.maximum(magnitude, np.finfo(float).tiny))
+            fd_grid = self.ofdm.fft.fft(td_grid, axis=-1)[..., self.ofdm.subcarrier_bins]
 
-            # Learn on the postdistorter
-            self.coeffs = self.perform_least_squares(pa_output, pa_input).reshape(self.coeffs.shape)
+        spectrum[..., self.ofdm.subcarrier_bins] = fd_grid
+        td_grid = self.ofdm.fft.ifft(spectrum, axis=-1)
+        # Cyclic prefix on every symbol and back to one stream per signal
+        td_grid = np.concatenate((td_grid[..., self.ofdm.fft_size - self.ofdm.cp_length:], td_grid), axis=-1)
+        out = td_grid.reshape(np.shape(x)).astype(np.complex64)
+        return out, papr(out), ccdf(out, self.ccdf_thresholds)
 
 
 if __name__ == "__main__":
@@ -47,6 +242,7 @@ if __name__ == "__main__":
 
     ofdm = modulators.OFDM(n_subcarriers=600)
     x = ofdm.use(n_symbols=4)
+    x, papr_db, _ = CFR(ofdm).process(x)
 
     x = x*15
 
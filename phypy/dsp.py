@@ -1,4 +1,7 @@
 """DSP Module for basic DSP functions"""
+import functools
+import math
+
 import numpy as np
 
 
@@ -6,11 +9,222 @@ def frequency_shift(signal, shift_amount, sampling_rate):
     """Performs a shift in the freqeuency shift by multiplying by a complex sinusoid
 
     Args:
-        signal: The signal to be shifted as a nparray
+        signal: The signal to be shifted as a nparray, or signals along the last axis
         shift_amount: Amount to shift by in Hz
         sampling_rate: The original sampling rate of the signal in Hz
 
     Returns:
         Returns a nparray with the signal shifted by the shift amount
     """
-    return signal * np.exp(2*np.pi*1j*np.arange(signal.size)*shift_amount/sampling_rate)
+    return NCO(shift_amount, sampling_rate).mix(signal)
+
+
+class NCO:
+    """Numerically controlled oscillator for shifting a stream of blocks in frequency
+
+    The phase is kept between calls to mix so consecutive blocks are shifted without a phase
+    jump. The oscillator is built from a cached table of the first sub_block_size samples of the
+    sinusoid and one complex exponential per sub-block, taken from a phase accumulator reduced
+    mod 1. No exp is evaluated per sample, and since every sub-block's phasor comes straight from
+    the accumulator, magnitude and phase errors never build up.
+
+    Attributes:
+        shift_amount: Amount to shift by in Hz
+        sampling_rate: Sampling rate of the signal in Hz
+        phase: Phase in cycles of the next sample to be mixed
+    """
+
+    def __init__(self, shift_amount: float, sampling_rate: float, sub_block_size: int = 1024):
+        self.shift_amount = shift_amount
+        self.sampling_rate = sampling_rate
+        self.sub_block_size = sub_block_size
+        self.cycles_per_sample = shift_amount / sampling_rate
+        self.phase = 0.0
+        self.table = np.exp(2*np.pi*1j*self.cycles_per_sample*np.arange(sub_block_size))
+
+    def mix(self, block, out=None):
+        """Multiply a block by the next block.shape[-1] samples of the oscillator
+
+        A 2-D (n_signals, n_samples) batch is mixed along the last axis. The rows are signals over
+        the same stretch of time, so every row starts from the current phase and the phase then
+        advances by n_samples once.
+
+        Args:
+            block: The signal block to shift, or a batch of blocks along the last axis
+            out: Where to put the result. Pass block itself to shift in place.
+
+        Returns:
+            The shifted block
+        """
+        n_samples = block.shape[-1]
+        if out is None:
+            out = np.empty(block.shape, dtype=np.result_type(block, np.complex128))
+        n_sub_blocks = -(-n_samples // self.sub_block_size)
+        sub_block_phases = self.phase + self.cycles_per_sample*self.sub_block_size*np.arange(n_sub_blocks)
+        phasors = np.exp(2*np.pi*1j*np.mod(sub_block_phases, 1))
+
+        n_full = (n_samples // self.sub_block_size) * self.sub_block_size
+        if n_full:
+            # Splitting the last axis into sub-blocks is always a view, so full_out writes into out
+            sub_block_shape = block.shape[:-1] + (-1, self.sub_block_size)
+            full_out = out[..., :n_full].reshape(sub_block_shape)
+            np.multiply(block[..., :n_full].reshape(sub_block_shape), self.table, out=full_out)
+            full_out *= phasors[:n_full // self.sub_block_size, np.newaxis]
+        if n_full < n_samples:
+            tail_out = out[..., n_full:]
+            np.multiply(block[..., n_full:], self.table[:n_samples - n_full], out=tail_out)
+            tail_out *= phasors[-1]
+
+        self.phase = np.mod(self.phase + self.cycles_per_sample*n_samples, 1)
+        return out
+
+    def reset(self):
+        """Start the oscillator again from zero phase"""
+        self.phase = 0.0
+
+
+def iterate_blocks(signal, block_size):
+    """Split a signal into consecutive blocks without copying
+
+    Args:
+        signal: The signal to be split as a nparray (or np.memmap)
+        block_size: Number of samples per block. The last block may be shorter.
+
+    Returns:
+        A generator of views into the signal
+    """
+    if block_size <= 0:
+        raise Exception("The block size must be a positive int")
+    for start in range(0, signal.shape[-1], block_size):
+        yield signal[..., start:start + block_size]
+
+
+class FFT:
+    """FFT/IFFT with a selectable backend
+
+    Attributes:
+        backend: 'numpy', 'scipy' (scipy.fft, multithreaded with workers) or 'pyfftw'
+        workers: Number of threads used by the scipy and pyfftw backends
+        plans: pyfftw plans cached by (direction, shape, dtype, axis)
+    """
+
+    def __init__(self, backend: str = 'numpy', workers: int = 1):
+        if backend == 'numpy':
+            self._module = np.fft
+        elif backend == 'scipy':
+            import scipy.fft
+            self._module = scipy.fft
+        elif backend == 'pyfftw':
+            import pyfftw.builders
+            self._module = pyfftw.builders
+        else:
+            raise Exception("The FFT backend must be numpy, scipy or pyfftw")
+        if workers <= 0:
+            raise Exception("The number of FFT workers must be a positive int")
+        self.backend = backend
+        self.workers = workers
+        self.plans = {}
+
+    def fft(self, x, axis: int = 0):
+        """FFT of x along axis"""
+        return self._transform('fft', x, axis)
+
+    def ifft(self, x, axis: int = 0):
+        """IFFT of x along axis"""
+        return self._transform('ifft', x, axis)
+
+    def _transform(self, direction, x, axis):
+        if self.backend == 'numpy':
+            return getattr(self._module, direction)(x, axis=axis)
+        if self.backend == 'scipy':
+            return getattr(self._module, direction)(x, axis=axis, workers=self.workers)
+
+        key = (direction, x.shape, x.dtype, axis)
+        if key not in self.plans:
+            self.plans[key] = getattr(self._module, direction)(np.empty(x.shape, dtype=x.dtype), axis=axis,
+                                                               threads=self.workers)
+        # The plan reuses its output array on every call so hand back a copy
+        return self.plans[key](x).copy()
+
+
+@functools.lru_cache(maxsize=32)
+def design_resampling_filter(up: int, down: int, taps_per_phase: int = 16, kaiser_beta: float = 8.0):
+    """Kaiser-windowed sinc lowpass for resampling by up/down
+
+    The cutoff is the lower of the input and output Nyquist frequencies and the gain is up so the
+    zero-stuffed signal keeps its amplitude. Designs are cached and returned read-only.
+
+    Returns:
+        A (up, taps_per_phase) array whose row p holds the taps h[p + j*up] of polyphase branch p
+    """
+    n_taps = taps_per_phase * up
+    cutoff = 1 / max(up, down)
+    t = np.arange(n_taps) - (n_taps - 1) / 2
+    h = up * cutoff * np.sinc(cutoff * t) * np.kaiser(n_taps, kaiser_beta)
+    polyphase = h.reshape(taps_per_phase, up).T.copy()
+    polyphase.flags.writeable = False
+    return polyphase
+
+
+class Resampler:
+    """Streaming polyphase rational resampler (upfirdn-style) that changes the rate by up/down
+
+    Blocks of any size can be passed to process and the concatenated outputs equal one call
+    on the whole signal. Signals may be batched along leading axes to resample many at once.
+    Each output sample is computed only from its taps_per_phase polyphase taps. Nothing is
+    zero-stuffed or computed and thrown away. The filter delays the signal by
+    (taps_per_phase*up - 1)/2 samples at the upsampled rate.
+    """
+
+    def __init__(self, up: int, down: int, taps_per_phase: int = 16):
+        if up <= 0 or down <= 0:
+            raise Exception("The resampling factors must be positive ints")
+        divisor = math.gcd(up, down)
+        self.up = up // divisor
+        self.down = down // divisor
+        self.taps_per_phase = taps_per_phase
+        self.filter = design_resampling_filter(self.up, self.down, taps_per_phase)
+        self.reset()
+
+    def reset(self):
+        """Start a new signal"""
+        self.history = None  # The last taps_per_phase - 1 input samples
+        self.n_inputs = 0
+        self.n_outputs = 0
+
+    def process(self, block):
+        """Resample the next block of the signal along its last axis
+
+        Returns:
+            Every output sample that depends only on the input received so far
+        """
+        n_history = self.taps_per_phase - 1
+        if self.history is None:
+            self.history = np.zeros(block.shape[:-1] + (n_history,), dtype=block.dtype)
+        samples = np.concatenate((self.history, block), axis=-1)
+        first_input = self.n_inputs - n_history  # Input index of samples[..., 0]
+        self.n_inputs += block.shape[-1]
+        self.history = samples[..., samples.shape[-1] - n_history:]
+
+        # Output m sits at m*down on the upsampled grid, i.e. input m*down//up with phase m*down%up
+        first_output = self.n_outputs
+        self.n_outputs = -(-self.n_inputs * self.up // self.down)
+        out = np.zeros(block.shape[:-1] + (self.n_outputs - first_output,),
+                       dtype=np.result_type(block, self.filter))
+
+        # Every up-th output uses the same phase and moves down inputs further along
+        for offset in range(min(self.up, out.shape[-1])):
+            m = first_output + offset
+            n_outputs = (out.shape[-1] - offset - 1) // self.up + 1
+            phase = m * self.down % self.up
+            newest_input = m * self.down // self.up - first_input
+            out_slice = out[..., offset::self.up]
+            for tap, coefficient in enumerate(self.filter[phase]):
+                start = newest_input - tap
+                out_slice += coefficient * samples[..., start:start + self.down * (n_outputs - 1) + 1:self.down]
+        return out
+
+
+def resample(signal, up: int, down: int, taps_per_phase: int = 16):
+    """Resample a signal, or a batch of signals along the last axis, by up/down"""
+    return Resampler(up, down, taps_per_phase).process(signal)
@@ -0,0 +1,141 @@
+"""Module for numerical performance metrics such as PSD, ACLR, NMSE, EVM, BER, and PAPR
+
+Everything here is vectorized over leading batch axes so many signals can be scored in one call,
+and nothing depends on matplotlib.
+"""
+import functools
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+@functools.lru_cache(maxsize=32)
+def get_window(name: str, n_points: int):
+    """Returns a cached, read-only window of n_points. Can be 'hann', 'hamming', 'blackman' or 'boxcar'"""
+    if name == 'hann':
+        window = np.hanning(n_points)
+    elif name == 'hamming':
+        window = np.hamming(n_points)
+    elif name == 'blackman':
+        window = np.blackman(n_points)
+    elif name == 'boxcar':
+        window = np.ones(n_points)
+    else:
+        raise Exception("The window must be hann, hamming, blackman or boxcar")
+    window.flags.writeable = False
+    return window
+
+
+def welch_psd(signals, sampling_rate: float = 1.0, nperseg: int = 1024, overlap: float = 0.5,
+              window: str = 'hann'):
+    """Two-sided Welch power spectral density of complex baseband signals
+
+    Args:
+        signals: A signal, or an array of signals along the last axis
+        sampling_rate: Sampling rate of the signals in Hz
+        nperseg: Length of each segment. Shortened to the signal length if needed.
+        overlap: Fraction of each segment that overlaps the next one
+        window: Name of the window applied to each segment. See get_window.
+
+    Returns:
+        (frequencies, psd) with frequencies increasing from -sampling_rate/2 and the psd in
+        power per Hz with shape signals.shape[:-1] + (nperseg,)
+    """
+    signals = np.asarray(signals)
+    n_samples = signals.shape[-1]
+    nperseg = min(nperseg, n_samples)
+    step = max(int(nperseg * (1 - overlap)), 1)
+    n_segments = (n_samples - nperseg) // step + 1
+
+    # Segments are strided views into the signals. Only the windowed copy is allocated.
+    strides = signals.strides[:-1] + (step * signals.strides[-1], signals.strides[-1])
+    segments = as_strided(signals, shape=signals.shape[:-1] + (n_segments, nperseg), strides=strides,
+                          writeable=False)
+    w = get_window(window, nperseg)
+    spectra = np.fft.fft(segments * w, axis=-1)
+    psd = np.mean(np.abs(spectra)**2, axis=-2) / (sampling_rate * np.sum(w**2))
+    frequencies = np.fft.fftshift(np.fft.fftfreq(nperseg, 1 / sampling_rate))
+    return frequencies, np.fft.fftshift(psd, axes=-1)
+
+
+def band_power(frequencies, psd, low: float, high: float):
+    """Integrate a psd from welch_psd over the band [low, high] Hz"""
+    df = frequencies[1] - frequencies[0]
+    in_band = (frequencies >= low) & (frequencies <= high)
+    return np.sum(psd[..., in_band], axis=-1) * df
+
+
+def aclr(signals, ofdm=None, sampling_rate: float = None, bandwidth: float = None, nperseg: int = 1024):
+    """Adjacent channel leakage ratio of the lower and upper adjacent channels in dB
+
+    The main channel is the occupied bandwidth centered at DC and the adjacent channels are the
+    same width, one bandwidth away. Adjacent channels are cut at the Nyquist frequency when they
+    do not fit in the sampled band.
+
+    Args:
+        signals: A signal, or an array of signals along the last axis
+        ofdm: OFDM modulator that made the signals. Gives the sampling rate and the occupied
+            bandwidth (n_subcarriers * subcarrier_spacing) unless they are passed explicitly.
+        sampling_rate: Sampling rate of the signals in Hz
+        bandwidth: Occupied bandwidth of the main channel in Hz
+        nperseg: Welch segment length
+
+    Returns:
+        Array of shape signals.shape[:-1] + (2,) holding the (lower, upper) ACLR in dB
+    """
+    if sampling_rate is None:
+        sampling_rate = ofdm.sampling_rate
+    if bandwidth is None:
+        bandwidth = ofdm.n_subcarriers * ofdm.subcarrier_spacing
+
+    frequencies, psd = welch_psd(signals, sampling_rate, nperseg)
+    main = band_power(frequencies, psd, -bandwidth / 2, bandwidth / 2)
+    lower = band_power(frequencies, psd, -3 * bandwidth / 2, -bandwidth / 2)
+    upper = band_power(frequencies, psd, bandwidth / 2, 3 * bandwidth / 2)
+    return 10 * np.log10(np.stack((lower, upper), axis=-1) / main[..., np.newaxis])
+
+
+def nmse(desired, actual, axis=-1):
+    """Normalized mean squared error of each signal along axis. Pass axis=None for one overall value"""
+    error_energy = np.sum(np.abs(desired - actual)**2, axis=axis)
+    return error_energy / np.sum(np.abs(desired)**2, axis=axis)
+
+
+def evm(reference, received, axis=None):
+    """Error vector magnitude in percent
+
+    Args:
+        reference: The transmitted constellation points
+        received: The received constellation points
+        axis: Axis or tuple of axes to average over. E.g. (-2, -1) gives one EVM per frame for a
+            batch of (n_subcarriers, n_symbols) grids and -1 gives one EVM per subcarrier.
+    """
+    return 100 * np.sqrt(nmse(reference, received, axis=axis))
+
+
+def bit_error_rate(reference_bits, received_bits, axis=None):
+    """Fraction of bits that differ, averaged over axis like evm"""
+    return np.mean(np.asarray(reference_bits) != np.asarray(received_bits), axis=axis)
+
+
+def papr(signals, axis=-1):
+    """Peak to average power ratio in dB of each signal along axis"""
+    power = np.abs(signals)**2
+    return 10 * np.log10(np.max(power, axis=axis) / np.mean(power, axis=axis))
+
+
+def ccdf(signals, thresholds_db):
+    """Complementary CDF of the instantaneous to average power ratio
+
+    Args:
+        signals: A signal, or an array of signals along the last axis
+        thresholds_db: Power ratios in dB to evaluate
+
+    Returns:
+        Array of shape signals.shape[:-1] + (len(thresholds_db),) holding the fraction of samples
+        of each signal whose power is more than each threshold above the signal's mean power
+    """
+    power = np.abs(signals)**2
+    ratio = power / np.mean(power, axis=-1, keepdims=True)
+    thresholds = 10**(np.asarray(thresholds_db) / 10)
+    return np.mean(ratio[..., np.newaxis, :] > thresholds[:, np.newaxis], axis=-1)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+"""Time-correlated multi-user MIMO channel models
+
+Channels are (n_subcarriers, n_users, n_antennas) tensors, matching the precoders, so the symbols
+received on subcarrier s are H[s] @ x[s]. Every update ages the whole tensor with one vectorized
+draw and applying the channel to a precoded OFDM grid is one batched matmul.
+"""
+import abc
+import logging
+
+import numpy as np
+try:
+    from ..modulators import OFDM
+    from ..rng import make_rng
+except:
+    from phypy.modulators import OFDM
+    from phypy.rng import make_rng
+
+logger = logging.getLogger(__name__)
+
+
+def complex_normal(rng, shape, scale: float = 1.0):
+    """Circularly-symmetric complex Gaussian samples of variance scale**2 drawn in one call"""
+    samples = rng.standard_normal(tuple(shape) + (2,)).view(np.complex128)[..., 0]
+    samples *= scale / np.sqrt(2)
+    return samples
+
+
+class MimoChannel(abc.ABC):
+    """Base class for channels that age with an AR(1) (Gauss-Markov) process
+
+    Each update sets h = correlation * h + sqrt(1 - correlation**2) * w with w ~ CN(0, 1), so the
+    channel keeps unit average power and its correlation across k updates is correlation**k.
+
+    Attributes:
+        n_users: Number of single antenna users
+        n_antennas: Number of base station antennas
+        n_subcarriers: Number of occupied OFDM subcarriers
+        update_rate: Number of symbols between channel updates
+        correlation: AR(1) coefficient between consecutive updates. 1 is a static channel and 0
+            is block fading.
+        matrix: The current (n_subcarriers, n_users, n_antennas) channel
+        rng: numpy Generator for the channel realizations
+    """
+
+    def __init__(self, n_users: int = 8, n_antennas: int = 64, n_subcarriers: int = 1200,
+                 update_rate: int = 7, correlation: float = 0.9, seed=None):
+        if not 0 <= correlation <= 1:
+            raise Exception("The correlation must be between 0 and 1")
+        self.n_users = n_users
+        self.n_antennas = n_antennas
+        self.n_subcarriers = n_subcarriers
+        self.update_rate = update_rate
+        self.correlation = correlation
+        self.innovation_scale = np.sqrt(1 - correlation**2)
+        self.rng = make_rng(seed)
+        self.matrix = None  # Will be set by the subclass
+
+    @abc.abstractmethod
+    def update_channel(self):
+        """Age the channel by one update"""
+
+    def age(self, state):
+        """Apply one AR(1) step to the state array in place and return it"""
+        state *= self.correlation
+        state += complex_normal(self.rng, state.shape, self.innovation_scale)
+        return state
+
+    def apply(self, antenna_signals, noise_variance: float = 0.0):
+        """Pass precoded OFDM grids through the channel
+
+        Args:
+            antenna_signals: (n_subcarriers, n_antennas) antenna signals for one OFDM symbol, or
+                (n_subcarriers, n_antennas, n_symbols) for a block of OFDM symbols
+            noise_variance: Variance of the complex AWGN added at each user
+
+        Returns:
+            (n_subcarriers, n_users) or (n_subcarriers, n_users, n_symbols) received symbols
+        """
+        if antenna_signals.ndim == 2:
+            received = np.einsum('sua,sa->su', self.matrix, antenna_signals)
+        else:
+            received = np.matmul(self.matrix, antenna_signals)
+        if noise_variance:
+            received += complex_normal(self.rng, received.shape, np.sqrt(noise_variance))
+        return received
+
+    def channel_update_process(self, env):
+        """simpy process that ages the channel every update_rate symbols"""
+        while True:
+            logger.debug('Current Symbol = %s. Updating channel', env.now)
+            self.update_channel()
+            yield env.timeout(self.update_rate)
+
+
+class GaussMarkovChannel(MimoChannel):
+    """Rayleigh channel whose every subcarrier, user and antenna gain ages independently"""
+
+    def __init__(self, n_users: int = 8, n_antennas: int = 64, n_subcarriers: int = 1200,
+                 update_rate: int = 7, correlation: float = 0.9, seed=None):
+        super().__init__(n_users, n_antennas, n_subcarriers, update_rate, correlation, seed)
+        self.matrix = complex_normal(self.rng, (n_subcarriers, n_users, n_antennas))
+
+    def update_channel(self):
+        self.age(self.matrix)
+
+
+class TappedDelayLineChannel(MimoChannel):
+    """Frequency selective Rayleigh channel made of aging time-domain taps
+
+    Every user/antenna pair has n_taps taps, one sample apart, with an exponential power delay
+    profile. The taps age with the AR(1) process. The frequency response on every subcarrier is
+    the FFT of the taps zero-padded to fft_size, evaluated only at the occupied bins. That pruned
+    DFT is precomputed as a (n_subcarriers, n_taps) matrix so each update is one GEMM, which for
+    the usual handful of taps is far cheaper than the full length FFT.
+
+    Attributes:
+        n_taps: Number of channel taps
+        decay: Taps over which the power delay profile falls by 1/e
+        fft_size: FFT size of the OFDM modulator
+        subcarrier_bins: FFT bin of each occupied subcarrier
+        taps: The current (n_taps, n_users, n_antennas) taps, each with unit average power
+    """
+
+    def __init__(self, n_users: int = 8, n_antennas: int = 64, n_subcarriers: int = 1200,
+                 update_rate: int = 7, correlation: float = 0.9, n_taps: int = 8, decay: float = 2.0,
+                 fft_size: int = None, seed=None):
+        super().__init__(n_users, n_antennas, n_subcarriers, update_rate, correlation, seed)
+        self.n_taps = n_taps
+        self.decay = decay
+        if fft_size is None:
+            fft_size = np.power(2, int(np.ceil(np.log2(n_subcarriers))))
+        if n_taps > fft_size:
+            raise Exception("The channel can not have more taps than the FFT size")
+        self.fft_size = fft_size
+        self.subcarrier_bins = OFDM.map_subcarriers(n_subcarriers, fft_size)
+
+        power_delay_profile = np.exp(-np.arange(n_taps) / decay)
+        self.tap_scales = np.sqrt(power_delay_profile / np.sum(power_delay_profile))
+        self.dft_matrix = self.tap_scales * np.exp(-2j * np.pi * np.outer(self.subcarrier_bins, np.arange(n_taps))
+                                                   / fft_size)
+        self.taps = complex_normal(self.rng, (n_taps, n_users, n_antennas))
+        self.matrix = self.frequency_response()
+
+    def frequency_response(self):
+        """(n_subcarriers, n_users, n_antennas) response of the current taps"""
+        response = np.matmul(self.dft_matrix, self.taps.reshape(self.n_taps, -1))
+        return response.reshape(self.n_subcarriers, self.n_users, self.n_antennas)
+
+    def update_channel(self):
+        self.age(self.taps)
+        self.matrix = self.frequency_response()
@@ -1,5 +1,25 @@
+import logging
+
 import numpy as np
-import simpy
+try:
+    from .precoders import ZeroForcing, MMSE, MaximumRatio
+    from .channels import GaussMarkovChannel
+except:
+    from precoders import ZeroForcing, MMSE, MaximumRatio
+    from channels import GaussMarkovChannel
+
+logger = logging.getLogger(__name__)
+
+TIMELINE_DTYPE = np.dtype([('start', '<i8'),
+                           ('stop', '<i8'),
+                           ('update_channel', '?'),
+                           ('update_precoder', '?')])
+
+PRECODERS = {
+    'zero_forcing': ZeroForcing,
+    'mmse': MMSE,
+    'maximum_ratio': MaximumRatio
+}
 
 
 class MimoTransmitter:
@@ -9,87 +29,116 @@ class MimoTransmitter:
                  n_antennas: int = 64,
                  n_users: int = 4,
                  precoder: str = 'zero_forcing',
-                 update_precoder_frequency: int = 7):
+                 update_precoder_frequency: int = 7,
+                 precoder_options: dict = None):
         self.n_antennas = n_antennas
         self.n_users = n_users
         self.channel_matrix = None  # Will store the channel matrix when we get it.
-        self.precoder = ZeroForcing(self.channel_matrix, update_precoder_frequency)
+        if precoder not in PRECODERS:
+            raise Exception(f"The precoder must be one of {list(PRECODERS)}")
+        # precoder_options are extra keyword arguments for the precoder, e.g. {'incremental': True}
+        options = {} if precoder_options is None else precoder_options
+        self.precoder = PRECODERS[precoder](self.channel_matrix, update_precoder_frequency, **options)
 
     def update_channel(self, channel):
         """ The channel object exists in its own object. Periodically, our transmitter will get new CSI/channel.
-        This method updates the classes copy of the channel"""
+        This method updates the classes copy of the channel and recomputes the precoder"""
+        self.channel_matrix = np.array(channel)  # Copy since channels may age their matrix in place
+        self.precoder.create_precoder_matrix(channel)
 
     def transmit(self, symbols):
-        pass
-
-
-class LinearPrecoder:
-    def __init__(self):
-        pass
-
-    def precode(self, symbols):
-        out = np.dot(self.precoding_matrix, symbols)
-        return out
-
-    def precode_update_process(self, env):
-        env.timeout(
-            0.001
-        )  # Small delay so that we always update based on a new channel
-        while True:
-            print(f'Current Symbol = {env.now}. Updating precoder')
-            self.create_precoder_matrix(self.precoding_matrix)
-            yield env.timeout(self.update_rate)
-
-
-class ZeroForcing(LinearPrecoder):
-    def __init__(self, channel_matrix, update_rate):
-        self.precoding_matrix = None  # Will be set by create_precoder_matrix method
-        self.create_precoder_matrix(channel_matrix)
-        self.update_rate = update_rate
-
-    def create_precoder_matrix(self, channel_matrix):
-        self.precoding_matrix = channel_matrix
-
-
-class MIMO_Channel:
-    def channel_update_process(self, env):
-        while True:
-            print(f'Current Symbol = {env.now}. Updating channel')
-            self.update_channel()
-            yield env.timeout(self.update_rate)
-
-
-class MimoAwgn(MIMO_Channel):
-    def __init__(self, n_users: int = 8, n_antennas: int = 64, n_subcarriers=1200, update_rate: int = 7):
-        self.n_users = n_users
-        self.n_antennas = n_antennas
-        self.n_subcarriers = n_subcarriers
-        self.update_rate = update_rate
-        self.matrix = 1
-
-    def update_channel(self):
-        new_channel = 0.9*old_channel + guassian
-        pass
+        """Precode (n_subcarriers, n_users[, n_symbols]) user symbols onto the antennas"""
+        return self.precoder.precode(symbols)
+
+
+class MimoAwgn(GaussMarkovChannel):
+    """Rayleigh channel that keeps 90% correlation between updates"""
+
+    def __init__(self, n_users: int = 8, n_antennas: int = 64, n_subcarriers=1200, update_rate: int = 7,
+                 seed=None):
+        super().__init__(n_users, n_antennas, n_subcarriers, update_rate, correlation=0.9, seed=seed)
+
+
+class UpdateScheduler:
+    """Runs a transmitter and channel over a block of symbols with fixed period updates
+
+    The channel updates every channel.update_rate symbols and the precoder every
+    transmitter.precoder.update_rate symbols, so the whole update timeline is known up front. The
+    symbols between two updates are precoded and passed through the channel as one batch. When
+    both update on the same symbol the channel goes first, so the precoder always uses the newest
+    channel. Every update is logged at DEBUG level to the phypy.mimo.mimo logger.
+
+    The simpy processes (channel_update_process and precode_update_process) are still available
+    for simulations with irregular events.
+
+    Attributes:
+        transmitter: The MimoTransmitter
+        channel: The MimoChannel between the transmitter and the users
+        noise_variance: Variance of the AWGN added at each user
+    """
+
+    def __init__(self, transmitter, channel, noise_variance: float = 0.0):
+        self.transmitter = transmitter
+        self.channel = channel
+        self.noise_variance = noise_variance
+
+    def update_timeline(self, n_symbols: int):
+        """Segments of symbols that share a channel and precoder
+
+        Returns:
+            A structured array with one TIMELINE_DTYPE row per segment. The updates flagged in a
+            row happen before its symbols [start, stop) are sent.
+        """
+        channel_updates = np.arange(0, n_symbols, self.channel.update_rate)
+        precoder_updates = np.arange(0, n_symbols, self.transmitter.precoder.update_rate)
+        starts = np.union1d(channel_updates, precoder_updates)
+        timeline = np.zeros(starts.size, dtype=TIMELINE_DTYPE)
+        timeline['start'] = starts
+        timeline['stop'] = np.append(timeline['start'][1:], n_symbols)
+        timeline['update_channel'] = np.isin(timeline['start'], channel_updates)
+        timeline['update_precoder'] = np.isin(timeline['start'], precoder_updates)
+        return timeline
+
+    def run(self, symbols):
+        """Send a block of user symbols through the precoder and channel
+
+        Args:
+            symbols: (n_subcarriers, n_users, n_symbols) user symbols. Any array that can be sliced
+                along the last axis works, e.g. an np.memmap.
+
+        Returns:
+            The (n_subcarriers, n_users, n_symbols) symbols received by the users
+        """
+        n_subcarriers, n_users, n_symbols = symbols.shape
+        received = np.empty((n_subcarriers, n_users, n_symbols), dtype=np.complex128)
+        for start, stop, update_channel, update_precoder in self.update_timeline(n_symbols):
+            if update_channel:
+                logger.debug('Current Symbol = %d. Updating channel', start)
+                self.channel.update_channel()
+            if update_precoder:
+                logger.debug('Current Symbol = %d. Updating precoder', start)
+                self.transmitter.update_channel(self.channel.matrix)
+            antenna_signals = self.transmitter.transmit(np.asarray(symbols[..., start:stop]))
+            received[..., start:stop] = self.channel.apply(antenna_signals, self.noise_variance)
+        return received
 
 
 if __name__ == "__main__":
-    env = simpy.Environment()
-    update_channel_frequency = 1  # Every 2 symbols, make new  MIMO channel
+    logging.basicConfig(level=logging.DEBUG)
+    update_channel_frequency = 1  # Every symbol, make new MIMO channel
     update_precoder_frequency = 7
     n_users = 4
     n_antennas = 64
     n_subcarriers = 1200
     n_symbols = 64
 
-    channel = MimoAwgn(n_users=n_users, n_antennas=n_antennas, n_subcarriers=n_subcarriers)
+    channel = MimoAwgn(n_users=n_users, n_antennas=n_antennas, n_subcarriers=n_subcarriers,
+                       update_rate=update_channel_frequency)
     tx = MimoTransmitter(n_users=n_users, n_antennas=n_antennas,
                          update_precoder_frequency=update_precoder_frequency)
-    env.process(channel.channel_update_process(env))
-    env.process(tx.precoder.precode_update_process(env))
-    env.run(until=n_symbols)
+    symbols = np.ones((n_subcarriers, n_users, n_symbols))
+    received = UpdateScheduler(tx, channel).run(symbols)
 
     print(tx.n_antennas)
     print(tx.n_users)
     print(tx.precoder)
-
-
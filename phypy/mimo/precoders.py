@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+"""Linear precoders for multi-user MIMO downlink
+
+Channels are (n_subcarriers, n_users, n_antennas) tensors so that the received symbols on
+subcarrier s are H[s] @ x[s]. Precoders are the matching (n_subcarriers, n_antennas, n_users)
+tensors. Every per-subcarrier precoder is computed in one batched operation.
+"""
+import abc
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class LinearPrecoder(abc.ABC):
+    """Base class for linear precoders W that map user symbols to antennas by x = W @ s
+
+    Attributes:
+        precoding_matrix: (n_subcarriers, n_antennas, n_users) precoder. None until a channel is given.
+        update_rate: Number of symbols between precoder updates
+        normalize: Scale each subcarrier's precoder to unit Frobenius norm (unit transmit power
+            for unit power symbols)
+    """
+
+    def __init__(self, channel_matrix=None, update_rate: int = 7, normalize: bool = True):
+        self.precoding_matrix = None  # Will be set by create_precoder_matrix method
+        self.update_rate = update_rate
+        self.normalize = normalize
+        if channel_matrix is not None:
+            self.create_precoder_matrix(channel_matrix)
+
+    def create_precoder_matrix(self, channel_matrix):
+        """Compute the precoders of every subcarrier for a (n_subcarriers, n_users, n_antennas) channel"""
+        channel_matrix = np.asarray(channel_matrix)
+        if channel_matrix.ndim == 2:
+            channel_matrix = channel_matrix[np.newaxis]
+        precoding_matrix = self.compute_precoder(channel_matrix)
+        if self.normalize:
+            norms = np.linalg.norm(precoding_matrix, axis=(-2, -1), keepdims=True)
+            precoding_matrix = precoding_matrix / np.where(norms > 0, norms, 1)
+        self.precoding_matrix = precoding_matrix
+
+    @abc.abstractmethod
+    def compute_precoder(self, channel_matrix):
+        """Returns the unnormalized (n_subcarriers, n_antennas, n_users) precoder"""
+
+    def precode(self, symbols):
+        """Map user symbols to antenna signals on every subcarrier
+
+        Args:
+            symbols: (n_subcarriers, n_users) symbols for one OFDM symbol, or
+                (n_subcarriers, n_users, n_symbols) for a block of OFDM symbols
+
+        Returns:
+            (n_subcarriers, n_antennas) or (n_subcarriers, n_antennas, n_symbols) antenna signals
+        """
+        if symbols.ndim == 2:
+            return np.einsum('sau,su->sa', self.precoding_matrix, symbols)
+        return np.matmul(self.precoding_matrix, symbols)
+
+    def precode_update_process(self, env, channel):
+        """simpy process that recomputes the precoder from channel.matrix every update_rate symbols"""
+        yield env.timeout(0.001)  # Small delay so that we always update based on a new channel
+        while True:
+            logger.debug('Current Symbol = %s. Updating precoder', env.now)
+            self.create_precoder_matrix(channel.matrix)
+            yield env.timeout(self.update_rate)
+
+
+class ZeroForcing(LinearPrecoder):
+    """Zero-forcing precoder W = H^H (H H^H)^-1 that nulls all inter-user interference
+
+    With incremental=True the inverse of the n_users x n_users Gram matrix of every subcarrier is
+    kept between updates. On the next channel it is refined with a few Newton-Schulz iterations,
+    X <- X (2I - G X), warm started from the previous inverse. Each iteration is two batched
+    matmuls and squares the residual ||I - G X||, so slowly aging channels need no factorization
+    at all. Subcarriers are inverted exactly instead as soon as the residual shows they cannot
+    reach drift_threshold: when it starts at 1 or more, or when ||I - G X||**(2**k) is still above
+    drift_threshold with k iterations left.
+
+    Attributes:
+        incremental: Refine the previous Gram inverse instead of recomputing it
+        n_iterations: Newton-Schulz iterations per update
+        drift_threshold: Largest Frobenius norm of I - G X accepted before exact recomputation
+        gram_inverse: (n_subcarriers, n_users, n_users) inverses kept for incremental updates
+        n_exact: Number of subcarriers inverted exactly in the last update
+    """
+
+    def __init__(self, channel_matrix=None, update_rate: int = 7, normalize: bool = True,
+                 incremental: bool = False, n_iterations: int = 3, drift_threshold: float = 1e-6):
+        self.incremental = incremental
+        self.n_iterations = n_iterations
+        self.drift_threshold = drift_threshold
+        self.gram_inverse = None
+        self.n_exact = 0
+        super().__init__(channel_matrix, update_rate, normalize)
+
+    def regularization(self, channel_matrix):
+        """Value added to the diagonal of the Gram matrix before inverting it"""
+        return 0
+
+    def compute_precoder(self, channel_matrix):
+        regularization = self.regularization(channel_matrix)
+        if not self.incremental:
+            return self.regularized_inverse(channel_matrix, regularization)
+        gram = self.gram_matrix(channel_matrix, regularization)
+        self.gram_inverse = self.update_gram_inverse(gram)
+        # W^H = X^H H keeps the large operand contiguous, which makes the batched matmul much faster
+        return np.matmul(self.gram_inverse.conj().swapaxes(-2, -1), channel_matrix).conj().swapaxes(-2, -1)
+
+    def update_gram_inverse(self, gram):
+        """Warm started Newton-Schulz refinement of gram_inverse with an exact fallback"""
+        if self.gram_inverse is None or self.gram_inverse.shape != gram.shape:
+            self.n_exact = gram.shape[0]
+            return np.linalg.inv(gram)
+
+        identity = np.identity(gram.shape[-1])
+        residual = identity - np.matmul(gram, self.gram_inverse)
+        # Every iteration squares I - G X, so it can only converge from a norm below 1
+        start_limit = 1 if self.n_iterations else self.drift_threshold
+        active = np.flatnonzero(np.linalg.norm(residual, axis=(-2, -1)) < start_limit)
+        active_gram, inverse, residual = gram[active], self.gram_inverse[active], residual[active]
+        for remaining in reversed(range(self.n_iterations)):
+            inverse = inverse + np.matmul(inverse, residual)
+            residual = identity - np.matmul(active_gram, inverse)
+            # The remaining iterations leave at most norm**(2**remaining), stop once that misses the threshold
+            converging = np.linalg.norm(residual, axis=(-2, -1)) ** (2 ** remaining) <= self.drift_threshold
+            if not converging.all():
+                active, active_gram = active[converging], active_gram[converging]
+                inverse, residual = inverse[converging], residual[converging]
+
+        refined = np.empty_like(self.gram_inverse)
+        refined[active] = inverse
+        exact = np.ones(gram.shape[0], dtype=bool)
+        exact[active] = False
+        self.n_exact = np.count_nonzero(exact)
+        if self.n_exact:
+            refined[exact] = np.linalg.inv(gram[exact])
+        return refined
+
+    @staticmethod
+    def gram_matrix(channel_matrix, regularization):
+        """H H^H + regularization*I for every subcarrier"""
+        gram = np.matmul(channel_matrix, channel_matrix.conj().swapaxes(-2, -1))
+        if regularization:
+            gram = gram + regularization * np.identity(gram.shape[-1])
+        return gram
+
+    @staticmethod
+    def regularized_inverse(channel_matrix, regularization):
+        """H^H (H H^H + regularization*I)^-1 for every subcarrier
+
+        Solves the batched n_users x n_users systems instead of forming pseudo-inverses. Since the
+        Gram matrix G is Hermitian, W^H = G^-1 H, which is one batched np.linalg.solve.
+        """
+        gram = ZeroForcing.gram_matrix(channel_matrix, regularization)
+        return np.linalg.solve(gram, channel_matrix).conj().swapaxes(-2, -1)
+
+
+class MMSE(ZeroForcing):
+    """Regularized zero-forcing (MMSE) precoder W = H^H (H H^H + alpha*I)^-1
+
+    alpha = n_users * noise_variance / transmit_power trades interference nulling for noise
+    robustness. It approaches zero-forcing as the noise goes to 0 and matched filtering as it grows.
+    """
+
+    def __init__(self, channel_matrix=None, update_rate: int = 7, normalize: bool = True,
+                 noise_variance: float = 0.1, transmit_power: float = 1.0, incremental: bool = False,
+                 n_iterations: int = 3, drift_threshold: float = 1e-6):
+        self.noise_variance = noise_variance
+        self.transmit_power = transmit_power
+        super().__init__(channel_matrix, update_rate, normalize, incremental, n_iterations, drift_threshold)
+
+    def regularization(self, channel_matrix):
+        n_users = channel_matrix.shape[-2]
+        return n_users * self.noise_variance / self.transmit_power
+
+
+class MaximumRatio(LinearPrecoder):
+    """Maximum ratio transmission (conjugate beamforming) precoder W = H^H"""
+
+    def compute_precoder(self, channel_matrix):
+        return channel_matrix.conj().swapaxes(-2, -1)
@@ -4,7 +4,20 @@ These modulators are meant to turn arbitrary bit patterns to analog waveforms fo
 transmission.
 """
 
+import itertools
+from fractions import Fraction
+
 import numpy as np
+try:
+    from .dsp import FFT, NCO, Resampler
+    from .rng import make_rng
+    from .metrics import evm, bit_error_rate
+    from . import waveform_store
+except:
+    from dsp import FFT, NCO, Resampler
+    from rng import make_rng
+    from metrics import evm, bit_error_rate
+    import waveform_store
 
 
 class OFDM:
@@ -19,14 +32,19 @@ class OFDM:
         fft_size: Size of the IFFT/FFT used.
         sampling_rate: The native sampling rate based on the FFT size and subcarrier spacing
         symbol_alphabet: The constellation points
-
-    Todo:
-        - Add an arbitrary bit input
-        - Add a demodulator
+        bit_labels: (n_points, bits_per_symbol) Gray coded bits of each constellation point
+        pam_levels: Levels of the constellation along each of the I and Q axes
+        pam_labels: (n_levels, bits_per_symbol/2) bits of each level. The I level gives the first
+            half of a point's bits and the Q level the second half.
+        subcarrier_bins: IFFT bin of each subcarrier. Precomputed so modulation does no mapping work.
+        label_points: Constellation point of each integer bit label. bit_labels read as an
+            MSB first integer index this table.
+        fft: FFT backend used for modulation and demodulation
     """
 
     def __init__(self, n_subcarriers: int = 1200, subcarrier_spacing: int = 15000,
-                 cp_length: int = 144, constellation: str = 'QPSK', seed: int = 0):
+                 cp_length: int = 144, constellation: str = 'QPSK', seed: int = 0,
+                 fft_backend: str = 'numpy', fft_workers: int = 1):
         """OFDM Modulator Constructor.
 
         Construct an OFDM Modulator with custom number of subcarriers, subcarrier spacing,
@@ -38,17 +56,40 @@ class OFDM:
             cp_length: Number of samples in cyclic prefix
             constellation: Type of constellation used on each subcarrier. QPSK, 16QAM or 64QAM
             seed: Seed for the random number generator
+            fft_backend: numpy, scipy or pyfftw. See dsp.FFT
+            fft_workers: Number of FFT threads for the scipy and pyfftw backends
         """
         self.n_subcarriers = n_subcarriers
         self.subcarrier_spacing = subcarrier_spacing
         self.cp_length = cp_length
 
-        self.fft_size = np.power(2, np.int(np.ceil(np.log2(n_subcarriers))))
+        self.fft_size = np.power(2, int(np.ceil(np.log2(n_subcarriers))))
+        if not 0 <= cp_length <= self.fft_size:
+            raise Exception("The cyclic prefix must be between 0 and fft_size samples long")
         self.sampling_rate = self.subcarrier_spacing * self.fft_size
         self.symbol_alphabet = self.qam_alphabet(constellation)
+        self.bit_labels = self.qam_bit_labels(constellation)
+        self.bits_per_symbol = self.bit_labels.shape[1]
+        # The square QAMs are two Gray coded PAMs, so the demappers work on each axis separately
+        self.pam_levels = np.unique(self.symbol_alphabet.real)
+        self.pam_labels = self.gray_code(self.pam_levels.size)
+        self.label_points = np.empty_like(self.symbol_alphabet)
+        self.label_points[self.bits_to_labels(self.bit_labels.ravel())] = self.symbol_alphabet
         self.seed = seed
         self.fd_symbols = None  # We'll hold the last TX symbols for calculating error later
 
+        self.subcarrier_bins = self.map_subcarriers(self.n_subcarriers, self.fft_size)
+        self.fft = FFT(fft_backend, fft_workers)
+
+    @staticmethod
+    def map_subcarriers(n_subcarriers: int, fft_size: int):
+        """Returns the IFFT bin of each of n_subcarriers occupied subcarriers"""
+        # Index 0 is DC. Leave blank. The 1st half of the subcarriers needs to be in negative
+        # frequency so they go in the last IFFT inputs.
+        # TODO: Verify that the RB are mapping to the IFFT input correctly
+        half = n_subcarriers // 2
+        return np.concatenate((np.arange(fft_size - half, fft_size), np.arange(1, n_subcarriers - half + 1)))
+
     def use(self, n_symbols: int = 10):
         """Use the OFDM modulator to generate a random signal.
 
@@ -57,45 +98,142 @@ class OFDM:
 
         Returns:
             A time-domain OFDM signal
+        """
+        # Same draws as stream, so use(n) equals the first n symbols of stream and write_waveform
+        self.fd_symbols = self.random_symbols(make_rng(self.seed), n_symbols)
+        return self.modulate(self.fd_symbols)
+
+    def use_bits(self, data):
+        """Modulate a payload of packed bytes
+
+        The bits fill the subcarriers of one symbol before moving to the next. The last symbol is
+        padded with zero bits.
+
+        Args:
+            data: Packed uint8 array, bytes, or anything np.unpackbits accepts
+
+        Returns:
+            A time-domain OFDM signal. The points sent are kept in fd_symbols.
+        """
+        self.fd_symbols = self.bits_to_symbols(data)
+        return self.modulate(self.fd_symbols)
+
+    def modulate(self, fd_symbols):
+        """Time-domain signal of a (n_subcarriers, n_symbols) grid of frequency domain points"""
+        # All symbols go through one IFFT along axis 0 and get their CP from one slice
+        td_grid = self.frequency_to_time_domain(fd_symbols)
+        return self.add_cyclic_prefix(td_grid).flatten(order='F')
+
+    def bits_to_labels(self, bits):
+        """Read every bits_per_symbol bits along the last axis as one MSB first integer label"""
+        bits = bits.reshape(bits.shape[:-1] + (-1, self.bits_per_symbol))
+        labels = np.zeros(bits.shape[:-1], dtype=np.intp)
+        for bit in range(self.bits_per_symbol):
+            labels <<= 1
+            labels |= bits[..., bit]
+        return labels
+
+    def bits_to_symbols(self, data):
+        """Gray map packed bytes onto a (n_subcarriers, n_symbols) grid of constellation points
+
+        The bytes are unpacked with np.unpackbits, every bits_per_symbol bits become an index into
+        label_points, and the points fill the grid symbol by symbol. The last symbol is padded with
+        zero bits.
+        """
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = np.frombuffer(data, dtype=np.uint8)
+        bits = np.unpackbits(np.asarray(data, dtype=np.uint8))
+        bits_per_ofdm_symbol = self.n_subcarriers * self.bits_per_symbol
+        n_symbols = -(-bits.size // bits_per_ofdm_symbol)
+        padded = np.zeros(n_symbols * bits_per_ofdm_symbol, dtype=np.uint8)
+        padded[:bits.size] = bits
+        points = self.label_points[self.bits_to_labels(padded)]
+        return points.reshape(n_symbols, self.n_subcarriers).T
+
+    def symbols_to_bytes(self, fd_symbols, n_bytes: int = None):
+        """Inverse of bits_to_symbols. Hard demaps a grid of received points and repacks the bits.
+
+        Args:
+            fd_symbols: (..., n_subcarriers, n_symbols) received points, e.g. from receive
+            n_bytes: Length of the payload. Drops the padding of the last symbol.
+
+        Returns:
+            (..., n_bytes) uint8 payloads
+        """
+        _, bits = self.demap(fd_symbols)
+        # Back to symbol major order so the bits come out in the order they went in
+        bits = bits.swapaxes(-3, -2).reshape(bits.shape[:-3] + (-1,))
+        return np.packbits(bits, axis=-1)[..., :n_bytes]
+
+    def stream(self, symbols_per_block: int = 14, n_blocks: int = None):
+        """Generate a random OFDM waveform block by block
+
+        The symbols come from a random stream seeded with self.seed, so an OFDMStreamDemodulator
+        built from this object can regenerate them as its EVM reference. Only one block is in
+        memory at a time, so the stream can be as long as needed.
+
+        Args:
+            symbols_per_block: Number of OFDM symbols in each yielded block
+            n_blocks: Number of blocks to generate. Never stops if None.
 
-        TODO:
-            - Allow to pass in an arbitrary bit pattern for modulation.
+        Returns:
+            A generator of time-domain blocks of symbols_per_block*(fft_size + cp_length) samples
         """
-        np.random.seed(self.seed)
-        self.fd_symbols = self.symbol_alphabet[
-            np.random.randint(self.symbol_alphabet.size, size=(self.n_subcarriers, n_symbols))]
-        out = np.zeros((self.fft_size + self.cp_length, n_symbols), dtype='complex64')
-        for index, symbol in enumerate(self.fd_symbols.T):
-            td_waveform = self.frequency_to_time_domain(symbol)
-            out[:, index] = self.add_cyclic_prefix(td_waveform)
+        rng = make_rng(self.seed)
+        blocks = itertools.count() if n_blocks is None else range(n_blocks)
+        for _ in blocks:
+            yield self.modulate(self.random_symbols(rng, symbols_per_block))
+
+    def write_waveform(self, path, n_symbols: int, symbols_per_block: int = 14):
+        """Generate a random OFDM waveform straight into a memory-mapped waveform file
+
+        Uses stream so only one block of symbols is ever in memory.
+
+        Args:
+            path: The waveform file to create
+            n_symbols: Number of OFDM symbols to generate
+            symbols_per_block: Number of symbols generated at a time
 
-        return out.flatten(1)
+        Returns:
+            The waveform_store.Waveform opened for reading
+        """
+        symbol_length = self.fft_size + self.cp_length
+        waveform = waveform_store.create_waveform(path, n_symbols * symbol_length, self.sampling_rate,
+                                                  self.fft_size, self.cp_length, self.seed)
+        n_blocks = -(-n_symbols // symbols_per_block)
+        start = 0
+        for block in self.stream(symbols_per_block, n_blocks):
+            block = block[:waveform.n_samples - start]
+            waveform.samples[start:start + block.size] = block
+            start += block.size
+        waveform.flush()
+        return waveform_store.open_waveform(path)
+
+    def random_symbols(self, rng, n_symbols):
+        """Draw a (n_subcarriers, n_symbols) grid of random constellation points
+
+        Points are drawn symbol by symbol so consecutive calls give the same sequence of symbols
+        no matter how they are split into calls.
+        """
+        indices = rng.integers(self.symbol_alphabet.size, size=(n_symbols, self.n_subcarriers))
+        return self.symbol_alphabet[indices.T]
 
     def frequency_to_time_domain(self, fd_symbol):
         """Convert the frequency domain symbol to time domain via IFFT
 
         Args:
-            fd_symbol: One frequency domain symbol
+            fd_symbol: One frequency domain symbol, or a (n_subcarriers, n_symbols) grid of them
 
         Returns:
-            time domain signal
+            time domain signal with one column per symbol if given a grid
         """
-        # TODO: Verify that the RB are mapping to the IFFT input correctly
-        ifft_input = np.zeros((self.fft_size), dtype='complex64')
-        # Index 0 is DC. Leave blank. The 1st half needs to be in negative frequency
-        # so they go in the last IFFT inputs.
-        ifft_input[1: np.int(self.n_subcarriers / 2) + 1] = \
-            fd_symbol[np.int(self.n_subcarriers / 2):]
-        ifft_input[-np.int(self.n_subcarriers / 2):] = \
-            fd_symbol[:np.int(self.n_subcarriers / 2)]
-        return np.fft.ifft(ifft_input)
+        ifft_input = np.zeros((self.fft_size,) + fd_symbol.shape[1:], dtype='complex64')
+        ifft_input[self.subcarrier_bins] = fd_symbol
+        return self.fft.ifft(ifft_input, axis=0)
 
     def time_to_frequency_domain(self, td_symbol):
-        full_fft_output = np.fft.fft(td_symbol, axis=0)
-        fd_symbols = np.zeros(shape=self.fd_symbols.shape, dtype='complex64')
-        fd_symbols[np.int(self.n_subcarriers / 2):, :] = full_fft_output[1:np.int(self.n_subcarriers/2) + 1, :]
-        fd_symbols[:np.int(self.n_subcarriers / 2), :] = full_fft_output[-np.int(self.n_subcarriers / 2):, :]
-        return fd_symbols
+        full_fft_output = self.fft.fft(td_symbol, axis=0)
+        return full_fft_output[self.subcarrier_bins].astype('complex64')
 
     def add_cyclic_prefix(self, td_waveform):
         """Adds cyclic prefix
@@ -103,16 +241,15 @@ class OFDM:
         Adds by taking the last few samples and appending it to the beginning of the signal
 
         Args:
-            td_waveform: IFFT output signal.
+            td_waveform: IFFT output signal. Either one symbol or a grid with one symbol per column.
 
         Returns:
             time domain signal with a cyclic prefix
         """
-
-        # TODO: verify my indexing
-        out = np.zeros(td_waveform.size + self.cp_length, dtype='complex64')
+        n_samples = td_waveform.shape[0]
+        out = np.empty((n_samples + self.cp_length,) + td_waveform.shape[1:], dtype='complex64')
         out[self.cp_length:] = td_waveform
-        out[:self.cp_length] = td_waveform[-self.cp_length:]
+        out[:self.cp_length] = td_waveform[n_samples - self.cp_length:]
         return out
 
     def remove_cyclic_prefix(self, td_grid):
@@ -135,16 +272,127 @@ class OFDM:
             "64QAM": 64
         }
         n_points = constellation_dict[constellation]
-        x = np.int(np.sqrt(n_points)) - 1
+        x = int(np.sqrt(n_points)) - 1
 
         alpha_n_points = np.arange(-x, x + 1, 2, dtype=int)
         A = np.kron(np.ones((x + 1, 1)), alpha_n_points)
         B = np.flipud(A.transpose())
         const_qam = A + 1j * B
-        alphabet = const_qam.flatten(1)
+        alphabet = const_qam.flatten(order='F')
         return alphabet
 
 
+    @staticmethod
+    def gray_code(n_levels: int):
+        """Returns the (n_levels, log2(n_levels)) Gray coded bits of each level, MSB first"""
+        n_bits = int(np.log2(n_levels))
+        codes = np.arange(n_levels) ^ (np.arange(n_levels) >> 1)
+        return ((codes[:, np.newaxis] >> np.arange(n_bits - 1, -1, -1)) & 1).astype(np.uint8)
+
+    @staticmethod
+    def qam_bit_labels(constellation):
+        """Returns the Gray coded bits of each point of qam_alphabet(constellation)
+
+        The first half of the bits Gray code the in-phase level and the second half the quadrature
+        level, so neighboring points differ by one bit.
+        """
+        alphabet = OFDM.qam_alphabet(constellation)
+        levels = np.unique(alphabet.real)
+        pam_labels = OFDM.gray_code(levels.size)
+        i_index = np.searchsorted(levels, alphabet.real)
+        q_index = np.searchsorted(levels, alphabet.imag)
+        return np.concatenate((pam_labels[i_index], pam_labels[q_index]), axis=-1)
+
+    def receive(self, frames, channel_response=None):
+        """Demodulate a batch of received frames to equalized frequency domain grids
+
+        Removes the cyclic prefixes, does one FFT over every symbol of every frame, and divides
+        each subcarrier by its channel.
+
+        Args:
+            frames: Received time-domain frames along the last axis. Each frame is a whole number
+                of OFDM symbols.
+            channel_response: Optional one-tap channel of each subcarrier with shape
+                (..., n_subcarriers) that broadcasts against the frames' batch shape
+
+        Returns:
+            (..., n_subcarriers, n_symbols) equalized constellation points
+        """
+        frames = np.asarray(frames)
+        symbol_length = self.fft_size + self.cp_length
+        if frames.shape[-1] % symbol_length:
+            raise Exception(f"Frames must be a whole number of {symbol_length} sample OFDM symbols")
+        n_symbols = frames.shape[-1] // symbol_length
+        td_grid = frames.reshape(frames.shape[:-1] + (n_symbols, symbol_length))[..., self.cp_length:]
+        fd_grid = self.fft.fft(td_grid, axis=-1)[..., self.subcarrier_bins].swapaxes(-2, -1)
+        if channel_response is not None:
+            fd_grid = fd_grid / np.asarray(channel_response)[..., np.newaxis]
+        return fd_grid
+
+    def demap(self, fd_symbols):
+        """Nearest point hard decisions
+
+        Every axis is sliced to the nearest PAM level, which finds the nearest QAM point without
+        computing the distance to every point.
+
+        Returns:
+            (indices, bits) with the symbol_alphabet index of each decision and its
+            (..., bits_per_symbol) bits
+        """
+        n_levels = self.pam_levels.size
+        step = self.pam_levels[1] - self.pam_levels[0]
+        i_index = np.clip(np.rint((fd_symbols.real - self.pam_levels[0]) / step), 0, n_levels - 1).astype(np.intp)
+        q_index = np.clip(np.rint((fd_symbols.imag - self.pam_levels[0]) / step), 0, n_levels - 1).astype(np.intp)
+        # qam_alphabet lists the points column by column from the top left
+        indices = i_index * n_levels + (n_levels - 1 - q_index)
+        return indices, self.bit_labels[indices]
+
+    def demap_llr(self, fd_symbols, noise_variance):
+        """Max-log LLRs log(P(b=0)/P(b=1)) of every bit
+
+        Each axis is compared against its few PAM levels instead of against every QAM point.
+
+        Args:
+            fd_symbols: Equalized constellation points
+            noise_variance: Complex noise variance of each point. Any shape that broadcasts against
+                fd_symbols, e.g. noise_variance / |H|**2 per subcarrier after equalization.
+
+        Returns:
+            (..., bits_per_symbol) LLRs in the bit order of bit_labels
+        """
+        ones = self.pam_labels.astype(bool)
+        n_axis_bits = ones.shape[1]
+        llrs = np.empty(fd_symbols.shape + (self.bits_per_symbol,))
+        for offset, axis_values in ((0, fd_symbols.real), (n_axis_bits, fd_symbols.imag)):
+            # Levels along the first axis so every min below is over contiguous arrays
+            levels = self.pam_levels.reshape((-1,) + (1,) * axis_values.ndim)
+            distances = (axis_values - levels)**2
+            for bit in range(n_axis_bits):
+                llrs[..., offset + bit] = (np.min(distances[ones[:, bit]], axis=0)
+                                           - np.min(distances[~ones[:, bit]], axis=0))
+        llrs /= np.asarray(noise_variance)[..., np.newaxis]
+        return llrs
+
+    def link_metrics(self, reference_symbols, received_symbols):
+        """Per-frame and per-subcarrier EVM and BER of equalized grids from receive
+
+        Args:
+            reference_symbols: The transmitted (..., n_subcarriers, n_symbols) constellation points
+            received_symbols: The equalized points with the same shape
+
+        Returns:
+            Dict of 'evm_per_frame' and 'ber_per_frame' with the batch shape of the grids, and
+            'evm_per_subcarrier' and 'ber_per_subcarrier' of shape (n_subcarriers,)
+        """
+        _, reference_bits = self.demap(reference_symbols)
+        _, received_bits = self.demap(received_symbols)
+        batch_axes = tuple(range(received_symbols.ndim - 2))
+        return {'evm_per_frame': evm(reference_symbols, received_symbols, axis=(-2, -1)),
+                'evm_per_subcarrier': evm(reference_symbols, received_symbols, axis=batch_axes + (-1,)),
+                'ber_per_frame': bit_error_rate(reference_bits, received_bits, axis=(-3, -2, -1)),
+                'ber_per_subcarrier': bit_error_rate(reference_bits, received_bits,
+                                                     axis=batch_axes + (-2, -1))}
+
     def demodulate(self, time_domain_rx_signal):
         """Demodulate a time domain signal back into the FD symbols"""
 
@@ -157,10 +405,132 @@ class OFDM:
         return fd_symbols, evm
 
     def calculate_evm(self, fd_rx_signal):
-        # Get error vectors
-        e = fd_rx_signal - self.fd_symbols
-        evm = 100 * np.linalg.norm(e) / np.linalg.norm(self.fd_symbols)
-        return evm
+        """EVM in percent of received FD symbols against the last transmitted ones"""
+        return evm(self.fd_symbols, fd_rx_signal)
+
+
+class OFDMStreamDemodulator:
+    """Incremental demodulator for waveforms made by OFDM.stream
+
+    Consumes arbitrarily sized chunks of samples, buffers any partial symbol, and keeps a
+    running EVM against the reference symbols regenerated from the modulator's seed.
+
+    Attributes:
+        ofdm: The OFDM modulator that made the stream
+        n_symbols: Number of symbols demodulated so far
+    """
+
+    def __init__(self, ofdm):
+        self.ofdm = ofdm
+        self.symbol_length = ofdm.fft_size + ofdm.cp_length
+        self.buffer = np.zeros(0, dtype='complex64')  # Samples of the next incomplete symbol
+        self.rng = make_rng(ofdm.seed)
+        self.error_energy = 0
+        self.reference_energy = 0
+        self.n_symbols = 0
+
+    def process(self, samples):
+        """Demodulate the symbols completed by this chunk of samples
+
+        Args:
+            samples: The next chunk of the received time-domain stream
+
+        Returns:
+            (n_subcarriers, n) FD symbols for the n symbols completed by this chunk
+        """
+        samples = np.concatenate((self.buffer, samples))
+        n_symbols = samples.size // self.symbol_length
+        n_used = n_symbols * self.symbol_length
+        self.buffer = samples[n_used:].copy()
+
+        td_grid = np.reshape(samples[:n_used], (self.symbol_length, n_symbols), order='F')
+        fd_symbols = self.ofdm.time_to_frequency_domain(self.ofdm.remove_cyclic_prefix(td_grid))
+        reference = self.ofdm.random_symbols(self.rng, n_symbols)
+        self.error_energy += np.linalg.norm(fd_symbols - reference)**2
+        self.reference_energy += np.linalg.norm(reference)**2
+        self.n_symbols += n_symbols
+        return fd_symbols
+
+    @property
+    def evm(self):
+        """Running EVM in percent over every symbol demodulated so far"""
+        if self.reference_energy == 0:
+            return None
+        return 100 * np.sqrt(self.error_energy / self.reference_energy)
+
+
+class CarrierAggregation:
+    """Builds a wideband multi-carrier waveform from several OFDM carriers
+
+    Each carrier is resampled to the common sampling rate with a streaming polyphase resampler,
+    shifted to its offset with an NCO, and summed. Carriers with the same sampling rate and
+    symbol length are modulated and resampled together as one batch. Everything runs block by
+    block so long stimuli never exist at the carrier rates or as per-carrier full-length arrays.
+
+    Attributes:
+        carriers: List of OFDM modulators
+        offsets: Center frequency of each carrier in Hz relative to DC
+        sampling_rate: Sampling rate of the combined waveform in Hz
+    """
+
+    def __init__(self, carriers, offsets, sampling_rate: float, taps_per_phase: int = 16):
+        if len(carriers) != len(offsets):
+            raise Exception("Need one frequency offset per carrier")
+        self.carriers = list(carriers)
+        self.offsets = list(offsets)
+        self.sampling_rate = sampling_rate
+        self.taps_per_phase = taps_per_phase
+
+        for carrier, offset in zip(self.carriers, self.offsets):
+            bandwidth = carrier.n_subcarriers * carrier.subcarrier_spacing
+            if abs(offset) + bandwidth / 2 > sampling_rate / 2:
+                raise Exception("Every carrier must fit within the Nyquist band of the combined waveform")
+
+        # Carriers that produce identical block shapes share a resampler and are batched together
+        self.groups = {}
+        for index, carrier in enumerate(self.carriers):
+            key = (carrier.sampling_rate, carrier.fft_size + carrier.cp_length)
+            self.groups.setdefault(key, []).append(index)
+
+    def stream(self, block_size: int = 30720, n_blocks: int = None, symbols_per_block: int = 14):
+        """Generate the combined waveform block by block
+
+        Args:
+            block_size: Number of output samples in each yielded block
+            n_blocks: Number of blocks to generate. Never stops if None.
+            symbols_per_block: Number of OFDM symbols each carrier modulates at a time
+
+        Returns:
+            A generator of complex blocks at sampling_rate
+        """
+        sources = []
+        for (carrier_rate, _), indices in self.groups.items():
+            ratio = (Fraction(self.sampling_rate) / Fraction(carrier_rate)).limit_denominator(10**6)
+            resampler = Resampler(ratio.numerator, ratio.denominator, self.taps_per_phase)
+            symbol_blocks = zip(*[self.carriers[i].stream(symbols_per_block) for i in indices])
+            ncos = [NCO(self.offsets[i], self.sampling_rate) for i in indices]
+            sources.append((indices, resampler, symbol_blocks, ncos))
+
+        pending = [np.zeros(0, dtype=np.complex128) for _ in self.carriers]
+        blocks = itertools.count() if n_blocks is None else range(n_blocks)
+        for _ in blocks:
+            for indices, resampler, symbol_blocks, ncos in sources:
+                while pending[indices[0]].size < block_size:
+                    resampled = resampler.process(np.stack(next(symbol_blocks)))
+                    for row, index, nco in zip(resampled, indices, ncos):
+                        pending[index] = np.concatenate((pending[index], nco.mix(row, out=row)))
+
+            out = np.zeros(block_size, dtype=np.complex128)
+            for index in range(len(self.carriers)):
+                out += pending[index][:block_size]
+                pending[index] = pending[index][block_size:]
+            yield out
+
+    def use(self, n_samples: int, block_size: int = 30720):
+        """Generate n_samples of the combined waveform"""
+        n_blocks = -(-n_samples // block_size)
+        return np.concatenate(list(self.stream(block_size, n_blocks)))[:n_samples]
+
 
 if __name__ == "__main__":
     ofdm = OFDM()
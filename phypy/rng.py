@@ -0,0 +1,34 @@
+"""Module for the random number generators owned by stochastic PHY objects
+
+Every stochastic object (PA noise, OFDM symbols, ...) owns a numpy Generator instead of using
+the global np.random state. Generators are made from a SeedSequence so independent child
+streams can be spawned for parallel workers, e.g. ``PowerAmp(seed=child)`` for each
+``child in rng.spawn(seed, n_workers)``.
+"""
+import numpy as np
+
+
+def make_seed_sequence(seed=None):
+    """Returns a SeedSequence for an int seed, None (fresh entropy), or an existing SeedSequence"""
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    return np.random.SeedSequence(seed)
+
+
+def make_rng(seed=None, bit_generator=np.random.PCG64):
+    """Create a Generator from a seed
+
+    Args:
+        seed: int, None, or SeedSequence. The same seed always gives the same stream.
+        bit_generator: Bit generator class. PCG64 by default, Philox is also a good choice for
+            many parallel streams.
+
+    Returns:
+        A numpy Generator
+    """
+    return np.random.Generator(bit_generator(make_seed_sequence(seed)))
+
+
+def spawn(seed, n_children: int):
+    """Spawn n_children independent SeedSequences from a seed for parallel workers"""
+    return make_seed_sequence(seed).spawn(n_children)
@@ -1,55 +1,391 @@
 """ File for mathematical structures like a memory polynomial"""
+import math
 
 import numpy as np
+try:
+    from .dsp import iterate_blocks
+    from .metrics import nmse
+except:
+    from dsp import iterate_blocks
+    from metrics import nmse
+
+
+BASIS_FAMILIES = ('odd', 'full', 'orthogonal')
+LUT_INDEXING = ('amplitude', 'power')
 
 
 class MemoryPolynomial:
 
-    def __init__(self, order: int = 5, memory_depth: int = 4, memory_stride: int = 1):
-        """Create an instance of a parallel Hammerstein, memory polynomial"""
+    def __init__(self, order: int = 5, memory_depth: int = 4, memory_stride: int = 1,
+                 regularization: float = 0.0001, basis: str = 'odd', cross_terms: int = 0,
+                 envelope_scale: float = 1.0):
+        """Create an instance of a parallel Hammerstein, memory polynomial
+
+        Each row of coeffs filters one nonlinear branch x(n - a) * E(|x(n - b)|) over the memory taps,
+        where E is a polynomial in the envelope set by the basis family:
+
+        - 'odd': E = |x|^(k-1) for odd k. The classic memory polynomial.
+        - 'full': E = |x|^(k-1) for every k up to order, adding the even order terms.
+        - 'orthogonal': Every order, mixed into the orthogonal polynomials of Raich et al. (2004),
+          which are much less correlated than the plain powers so the LS fits are better conditioned.
+          They assume the envelope is within [0, 1], so set envelope_scale to about the peak amplitude.
 
-        self.check_for_errors(order, memory_depth, memory_stride)
+        With cross_terms > 0 the model is a generalized memory polynomial. Every nonlinear branch
+        also gets lagging envelope terms x(n)|x(n-d)|^(k-1) and leading envelope terms
+        x(n-d)|x(n)|^(k-1) for d = memory_stride, ..., cross_terms*memory_stride.
+
+        Args:
+            order: Highest nonlinear order
+            memory_depth: Number of memory taps of each branch
+            memory_stride: Samples between memory taps
+            regularization: Ridge term added to the Gram matrix in LS fits
+            basis: 'odd', 'full', or 'orthogonal'
+            cross_terms: Number of lagging and of leading envelope cross terms per branch
+            envelope_scale: The envelope polynomials are evaluated at |x|/envelope_scale
+        """
+
+        self.check_for_errors(order, memory_depth, memory_stride, basis, cross_terms)
 
         # Save to object
         self.order = order
         self.memory_depth = memory_depth
         self.memory_stride = memory_stride
+        self.regularization = regularization  # Ridge term added to the Gram matrix in LS fits
+        self.basis = basis
+        self.cross_terms = cross_terms
+        self.envelope_scale = envelope_scale
+        self.branch_orders, self.polynomial_transform = self.basis_family(basis, order)
+        self.row_specs = self.setup_rows()
+        self.row_transform = self.setup_row_transform()
+        self.active_columns = None  # Boolean mask of the columns kept by prune. None keeps them all.
         self.coeffs = np.zeros((self.n_rows, self.memory_depth))
+        self.stream_state = None  # Past input samples carried between transmit_block calls
 
     def transmit(self, x):
-        """Transmit a signal through the Memory Polynomial object"""
-
-        X = self.setup_basis_matrix(x)
-        coeffs = self.coeffs.flatten().copy()
-        return np.dot(X, coeffs)
-
-    def perform_least_squares(self, x, y):
-        """Perform a least squares fit
-        Todo:
-            - Add support for regularized LS.
-        """
-        X = self.setup_basis_matrix(x)
-        lamb = 0.0001
-        coeffs = np.linalg.lstsq(np.dot(X.conj().T, X) +  lamb * np.identity(self.n_coeffs),
-                                                     X.conj().T.dot(y), rcond=None)[0]
-        return coeffs
-
-    def setup_basis_matrix(self, x):
-        """Setup a matrix of the signal and delayed replicas for multiplication by the coeffs"""
-        X = np.zeros((x.size, self.n_coeffs), dtype=np.complex64)
+        """Transmit a signal, or a 2-D (n_signals, n_samples) batch of signals, through the Memory Polynomial"""
+
+        return self.apply_branches(x)
+
+    def transmit_block(self, x):
+        """Transmit one block of a longer signal through the Memory Polynomial object
+
+        The last state_length input samples are kept between calls so that the concatenated
+        outputs of consecutive blocks equal a single transmit call on the whole signal. Call
+        reset_stream before starting a new signal.
+        """
+        y = self.apply_branches(x, initial_state=self.stream_state)
+        self.stream_state = self.carry_state(self.stream_state, x)
+        return y
+
+    def apply_branches(self, x, initial_state=None):
+        """Apply the coeffs to x without forming the basis matrix
+
+        Args:
+            x: Input signal, or a 2-D (n_signals, n_samples) batch of signals
+            initial_state: The state_length samples that preceded x. Zeros if not given.
+
+        Returns:
+            The output signal with the same shape as x
+        """
+        n_samples = x.shape[-1]
+        n_state = self.state_length
+        signal = self.padded_signal(x, initial_state)
+        coeffs = np.where(self.column_mask, self.coeffs.flatten(), 0).reshape(self.n_rows, self.memory_depth)
+        monomial_coeffs = self.row_transform.T @ coeffs
+
+        # The orthogonal basis' monomial weights are large and alternate in sign, so its gains are complex128
+        plain_powers = np.array_equal(self.polynomial_transform, np.identity(self.branch_orders.size))
+        gain_dtype = np.dtype(np.complex64 if plain_powers else np.complex128)
+        step = np.abs(signal).astype(np.finfo(gain_dtype).dtype)
+        if self.envelope_scale != 1:
+            step /= self.envelope_scale
+        if self.basis == 'odd':
+            step *= step  # Consecutive odd orders are |x|^2 apart
+
+        out = np.zeros(x.shape, dtype=np.result_type(np.complex64, coeffs.dtype))
+        gain = np.empty(signal.shape, dtype=gain_dtype)
+        scratch = np.empty(x.shape, dtype=np.result_type(signal, gain))
+        for delays in np.unique(self.row_specs[:, 1:], axis=0):
+            signal_delay, envelope_delay = delays
+            rows = np.flatnonzero(np.all(self.row_specs[:, 1:] == delays, axis=1))
+            polynomial_coeffs = np.zeros((self.branch_orders.size, self.memory_depth), dtype=gain_dtype)
+            polynomial_coeffs[self.row_specs[rows, 0]] = monomial_coeffs[rows]
+            for tap in np.flatnonzero(np.any(polynomial_coeffs != 0, axis=0)):
+                # Rows with the same delays add up to one gain per tap, G_m(|x|) = sum of c_km |x|^(k-1),
+                # evaluated by Horner's rule. Only ufuncs, so streaming stays bit-identical.
+                gain.fill(polynomial_coeffs[-1, tap])
+                for coeff in polynomial_coeffs[-2::-1, tap]:
+                    gain *= step
+                    gain += coeff
+                delay = tap * self.memory_stride
+                np.multiply(signal[..., n_state - signal_delay - delay:][..., :n_samples],
+                            gain[..., n_state - envelope_delay - delay:][..., :n_samples], out=scratch)
+                out += scratch
+        return out
+
+    def padded_signal(self, x, initial_state=None):
+        """Returns the state_length samples that preceded x followed by x, as complex64 or complex128"""
+        n_state = self.state_length
+        signal = np.zeros(x.shape[:-1] + (n_state + x.shape[-1],), dtype=np.result_type(x, np.complex64))
+        if initial_state is not None:
+            signal[..., :n_state] = initial_state
+        signal[..., n_state:] = x
+        return signal
+
+    def transmit_stream(self, blocks, block_size: int = None):
+        """Transmit a signal block by block, yielding one output block per input block
+
+        Args:
+            blocks: An iterable of 1-D signal blocks, or one long signal if block_size is given
+            block_size: Number of samples per block when blocks is a single signal
+
+        Returns:
+            A generator of output blocks. Peak memory is set by the block size.
+        """
+        if block_size is not None:
+            blocks = iterate_blocks(blocks, block_size)
+        self.reset_stream()
+        for block in blocks:
+            yield self.transmit_block(block)
+
+    def reset_stream(self):
+        """Forget the memory carried between transmit_block calls"""
+        self.stream_state = None
+
+    def carry_state(self, state, x):
+        """Returns the last state_length samples of the stream made of state followed by x"""
+        if state is None:
+            state = np.zeros(x.shape[:-1] + (self.state_length,), dtype=x.dtype)
+        if self.state_length == 0:
+            return state
+        return np.concatenate((state, x), axis=-1)[..., -self.state_length:]
+
+    def perform_least_squares(self, x, y, block_size: int = 65536):
+        """Perform a regularized least squares fit of y from the basis of x
+
+        The normal equations are accumulated block by block so only one block of the basis
+        matrix is in memory at a time.
+
+        Args:
+            x: Input signal
+            y: Desired output signal
+            block_size: Number of samples of basis matrix built at once
+
+        Returns:
+            The flattened coeffs
+        """
+        accumulator = self.accumulate_least_squares(iterate_blocks(x, block_size),
+                                                    iterate_blocks(y, block_size))
+        return accumulator.solve(self.regularization, self.active_columns)
+
+    def prune(self, x, y, n_columns: int, block_size: int = 65536):
+        """Fit y from x with only the n_columns most useful columns of the basis
+
+        The columns are chosen greedily by orthogonal matching pursuit on the normal equations
+        (see LeastSquaresAccumulator.greedy_select), then coeffs is refit on them. The pruned
+        columns stay zero in later fits and are skipped by transmit. Set active_columns to None
+        to use every column again.
+
+        Returns:
+            The boolean mask of kept columns, also stored in active_columns
+        """
+        accumulator = self.accumulate_least_squares(iterate_blocks(x, block_size),
+                                                    iterate_blocks(y, block_size))
+        self.active_columns = accumulator.greedy_select(n_columns, self.regularization)
+        self.coeffs = accumulator.solve(self.regularization, self.active_columns).reshape(self.coeffs.shape)
+        return self.active_columns
+
+    def gain_transform(self, gain: float):
+        """Matrix M with basis(gain * x) = monomial basis(x) @ M
+
+        The monomial basis (setup_basis_matrix with monomial=True) has the same rows built from the
+        plain powers, so each of its order k columns just scales by gain^k. The basis is the
+        monomial basis times B = kron(row_transform^T, I). Applying M = diag(gain^k) B to normal
+        equations accumulated on the monomial basis removes a gain without rebuilding the basis
+        and without inverting B.
+        """
+        scale = gain ** self.column_orders
+        column_transform = np.kron(self.row_transform.T, np.identity(self.memory_depth))
+        return scale[:, np.newaxis] * column_transform
+
+    def accumulate_least_squares(self, x_blocks, y_blocks, accumulator=None):
+        """Add consecutive (x, y) blocks of one signal to the normal equations
+
+        Args:
+            x_blocks: Iterable of consecutive input blocks. Memory is carried across them.
+            y_blocks: Iterable of the matching desired output blocks
+            accumulator: A LeastSquaresAccumulator to add to. A new one is made if not given.
+
+        Returns:
+            The accumulator
+        """
+        if accumulator is None:
+            accumulator = LeastSquaresAccumulator(self.n_coeffs)
+        state = None
+        for x_block, y_block in zip(x_blocks, y_blocks):
+            X = self.setup_basis_matrix(x_block, initial_state=state)
+            state = self.carry_state(state, x_block)
+            accumulator.update(X, y_block)
+        return accumulator
+
+    def setup_basis_matrix(self, x, out=None, initial_state=None, monomial: bool = False):
+        """Setup a matrix of the signal and delayed replicas for multiplication by the coeffs
+
+        Delayed replicas of each nonlinear branch are written into their columns by slice
+        assignment. The matrix is column-major so that each of those writes is a contiguous copy.
+
+        Args:
+            x: Input signal as a 1-D nparray, or a 2-D (n_signals, n_samples) batch of
+                independent signals. Memory never crosses from one row to the next.
+            out: Optional preallocated complex64 array of shape x.shape + (n_coeffs,) to fill.
+                Useful to reuse one buffer across many calls. Column-major is fastest.
+            initial_state: The state_length samples that preceded x. Zeros if not given.
+            monomial: Build the same rows from the plain powers |x|^(k-1) instead of the basis
+                family's envelope polynomials. See gain_transform.
+
+        Returns:
+            The basis matrix with shape x.shape + (n_coeffs,)
+        """
+        n_samples = x.shape[-1]
+        if out is None:
+            # Columns are the slowest axis so each one is contiguous in memory
+            out = np.moveaxis(np.empty((self.n_coeffs,) + x.shape, dtype=np.complex64), 0, -1)
+        elif out.shape != x.shape + (self.n_coeffs,):
+            raise Exception("The basis matrix buffer must have shape x.shape + (n_coeffs,)")
+
+        n_state = self.state_length
         column_index = 0
-        for order in range(1, self.order + 1, 2):
-            branch = np.multiply(x, np.power(np.abs(x), (order - 1)))
+        for branch in self.nonlinear_branches(x, initial_state, monomial=monomial):
             for tap in range(0, self.memory_depth):
-                delay = tap * self.memory_stride
-                X[:, column_index] = np.resize(np.insert(branch, 0, np.zeros(delay)), branch.size)
+                start = n_state - tap * self.memory_stride
+                out[..., column_index] = branch[..., start:start + n_samples]
                 column_index += 1
-        return X
+        return out
+
+    def nonlinear_branches(self, x, initial_state=None, monomial: bool = False):
+        """Yields the nonlinear branch of each row of coeffs as complex64
+
+        |x| is computed once and each envelope power is written into one reused buffer. Each
+        branch holds the state_length samples before x followed by x, so the replica delayed by d
+        samples is branch[..., state_length - d:][..., :x.shape[-1]]. The yielded array is reused
+        for the next row.
+
+        Args:
+            x: Input signal or batch of signals
+            initial_state: The state_length samples that preceded x. Zeros if not given.
+            monomial: Use the plain powers |x|^(k-1) as the envelope polynomials
+        """
+        signal = self.padded_signal(x, initial_state)
+        length = signal.shape[-1]
+        branch = np.empty(signal.shape, dtype=np.complex64)
+        magnitude = np.abs(signal)
+        if self.envelope_scale != 1:
+            magnitude /= self.envelope_scale
+
+        transform = np.identity(self.branch_orders.size) if monomial else self.polynomial_transform
+        row = 0
+        for polynomial, envelope in enumerate(self.envelope_polynomials(magnitude, transform)):
+            cross_envelope = envelope
+            constant = transform[polynomial, 0]
+            if self.branch_orders[polynomial] > 1 and constant:
+                # The order 1 part of a cross term would just repeat the linear branch
+                cross_envelope = envelope - constant
+            while row < self.n_rows and self.row_specs[row, 0] == polynomial:
+                _, signal_delay, envelope_delay = self.row_specs[row]
+                if signal_delay == envelope_delay == 0:
+                    np.multiply(signal, envelope, out=branch)
+                else:
+                    delay = max(signal_delay, envelope_delay)
+                    branch[..., :delay] = 0
+                    np.multiply(signal[..., delay - signal_delay:length - signal_delay],
+                                cross_envelope[..., delay - envelope_delay:length - envelope_delay],
+                                out=branch[..., delay:])
+                yield branch
+                row += 1
+
+    def envelope_polynomials(self, magnitude, transform):
+        """Yields the envelope polynomial E(|x|) of each branch, lowest order first
+
+        Args:
+            magnitude: |x|
+            transform: The weights of the powers |x|^(k-1) in each polynomial. See basis_family.
+        """
+        if np.array_equal(transform, np.identity(transform.shape[0])):
+            # Plain powers. np.power in the dtype of |x| keeps the columns bit-identical to the original
+            # x * np.power(np.abs(x), k - 1) basis, which repeated multiplication would not in float32.
+            powers = np.empty_like(magnitude)
+            for order in self.branch_orders:
+                if order == 1:
+                    powers.fill(1)  # np.power(|x|, 0) is exactly 1
+                    yield powers
+                else:
+                    yield np.power(magnitude, order - 1, out=powers)
+            return
+
+        # The weights are large and alternate in sign, so sum them in double precision
+        magnitude = magnitude.astype(np.float64, copy=False)
+        all_powers = [np.ones_like(magnitude)]
+        for _ in range(1, self.branch_orders.size):
+            all_powers.append(all_powers[-1] * magnitude)
+        for weights in transform:
+            envelope = np.zeros_like(magnitude)
+            for weight, power in zip(weights, all_powers):
+                if weight:
+                    envelope += weight * power
+            yield envelope
+
+    @staticmethod
+    def basis_family(basis, order):
+        """Returns the nonlinear orders and the transform from the powers |x|^(k-1) to the envelopes
+
+        Returns:
+            (orders, transform) where row i of the (n, n) transform holds the weights of the powers
+            |x|^(orders[j]-1) in envelope polynomial i
+        """
+        if basis == 'odd':
+            orders = np.arange(1, order + 1, 2)
+            return orders, np.identity(orders.size)
+        orders = np.arange(1, order + 1)
+        if basis == 'full':
+            return orders, np.identity(orders.size)
+
+        # Orthogonal polynomials for an envelope uniform on [0, 1], Raich, Qian and Zhou (2004)
+        transform = np.zeros((orders.size, orders.size))
+        for k in orders:
+            for j in range(1, k + 1):
+                transform[k - 1, j - 1] = ((-1)**(j + k) * math.factorial(k + j)
+                                           / (math.factorial(j - 1) * math.factorial(j + 1) * math.factorial(k - j)))
+        return orders, transform
+
+    def setup_rows(self):
+        """Returns a (n_rows, 3) array of (envelope polynomial, signal delay, envelope delay) per row"""
+        rows = []
+        for polynomial, order in enumerate(self.branch_orders):
+            rows.append((polynomial, 0, 0))
+            if order > 1:
+                for shift in range(1, self.cross_terms + 1):
+                    delay = shift * self.memory_stride
+                    rows.append((polynomial, 0, delay))  # Lagging envelope x(n)|x(n-d)|^(k-1)
+                    rows.append((polynomial, delay, 0))  # Leading envelope x(n-d)|x(n)|^(k-1)
+        return np.array(rows, dtype=int)
+
+    def setup_row_transform(self):
+        """Returns R with branch row r = sum over q of R[r, q] * monomial row q
+
+        The monomial rows are the same rows built with the plain powers |x|^(k-1). Only rows with
+        the same delays mix.
+        """
+        polynomials = self.row_specs[:, 0]
+        same_delays = np.all(self.row_specs[:, np.newaxis, 1:] == self.row_specs[np.newaxis, :, 1:], axis=-1)
+        return np.where(same_delays, self.polynomial_transform[np.ix_(polynomials, polynomials)], 0)
 
     @staticmethod
-    def check_for_errors(order, memory_depth, memory_stride):
+    def check_for_errors(order, memory_depth, memory_stride, basis='odd', cross_terms=0):
         """Check for errors. Must be odd order with positive memory"""
-        if order % 2 == 0 or order <= 0:
+        if basis not in BASIS_FAMILIES:
+            raise Exception(f"The basis must be one of {BASIS_FAMILIES}")
+
+        if order <= 0 or (basis == 'odd' and order % 2 == 0):
             raise Exception("PA Order must be positive and odd")
 
         if memory_depth <= 0:
@@ -58,12 +394,320 @@ class MemoryPolynomial:
         if memory_stride <= 0:
             raise Exception("Memory Stride must be a positive int")
 
+        if cross_terms < 0:
+            raise Exception("The number of cross terms must be a non-negative int")
+
     @property
     def n_coeffs(self):
         """"Total number of coefficients including the polynomial order and memory depth"""
         return self.memory_depth * self.n_rows
 
+    @property
+    def column_orders(self):
+        """Nonlinear order of each column of the basis matrix. The highest order for orthogonal columns."""
+        return np.repeat(self.branch_orders[self.row_specs[:, 0]], self.memory_depth)
+
+    @property
+    def column_mask(self):
+        """Boolean mask of the columns in use"""
+        if self.active_columns is None:
+            return np.ones(self.n_coeffs, dtype=bool)
+        return self.active_columns
+
+    @property
+    def state_length(self):
+        """Number of past samples needed by the deepest memory tap and cross term"""
+        return (self.memory_depth - 1 + self.cross_terms) * self.memory_stride
+
     @property
     def n_rows(self):
         """Total number of rows in the coeff matrix"""
-        return np.floor_divide(self.order + 1, 2)
+        return len(self.row_specs)
+
+
+class LeastSquaresAccumulator:
+    """Incremental normal equations for a linear least squares fit
+
+    Holds the K x K Gram matrix X^H X and the K-vector X^H y. Blocks of rows can be added in
+    any order and accumulators built on different parts of a capture (e.g. in worker
+    processes) can be merged, so memory stays O(K^2) no matter how long the capture is.
+    """
+
+    def __init__(self, n_coeffs: int):
+        self.n_coeffs = n_coeffs
+        self.gram = np.zeros((n_coeffs, n_coeffs), dtype=np.complex128)
+        self.cross_correlation = np.zeros(n_coeffs, dtype=np.complex128)
+        self.n_samples = 0
+
+    def update(self, X, y):
+        """Add the rows of the basis matrix X and the matching desired samples y
+
+        A batched (n_signals, n_samples, n_coeffs) basis is treated as one long set of rows.
+        """
+        X = X.reshape(-1, self.n_coeffs)
+        y = y.reshape(-1)
+        X_hermitian = X.conj().T
+        self.gram += np.dot(X_hermitian, X)
+        self.cross_correlation += np.dot(X_hermitian, y)
+        self.n_samples += X.shape[0]
+
+    def merge(self, other):
+        """Add the normal equations of another accumulator into this one"""
+        if other.n_coeffs != self.n_coeffs:
+            raise Exception("Can only merge accumulators with the same number of coeffs")
+        self.gram += other.gram
+        self.cross_correlation += other.cross_correlation
+        self.n_samples += other.n_samples
+        return self
+
+    def scale(self, factor: float):
+        """Weight every row accumulated so far by factor, e.g. a forgetting factor"""
+        self.gram *= factor
+        self.cross_correlation *= factor
+
+    def scale_columns(self, scale):
+        """Turn the normal equations of X into those of X*diag(scale)"""
+        scale = np.asarray(scale)
+        self.gram *= np.outer(scale.conj(), scale)
+        self.cross_correlation *= scale.conj()
+
+    def transform_columns(self, matrix):
+        """Turn the normal equations of X into those of X @ matrix"""
+        self.gram = matrix.conj().T @ self.gram @ matrix
+        self.cross_correlation = matrix.conj().T @ self.cross_correlation
+
+    def solve(self, regularization: float = 0.0, active_columns=None):
+        """Solve (X^H X + regularization*I) coeffs = X^H y
+
+        Uses a Cholesky factorization of the Hermitian system. Falls back to lstsq if the
+        regularized Gram matrix is not positive definite.
+
+        Args:
+            regularization: Ridge term added to the diagonal
+            active_columns: Optional boolean mask. Only these columns are fit and the other
+                coeffs are 0.
+        """
+        if active_columns is not None:
+            coeffs = np.zeros(self.n_coeffs, dtype=np.complex128)
+            coeffs[active_columns] = self.solve_subset(np.flatnonzero(active_columns), regularization)
+            return coeffs
+        return self.solve_subset(np.arange(self.n_coeffs), regularization)
+
+    def solve_subset(self, columns, regularization: float = 0.0):
+        """Solve the normal equations restricted to the given column indices"""
+        A = self.gram[np.ix_(columns, columns)] + regularization * np.identity(len(columns))
+        b = self.cross_correlation[columns]
+        try:
+            L = np.linalg.cholesky(A)
+        except np.linalg.LinAlgError:
+            return np.linalg.lstsq(A, b, rcond=None)[0]
+        return np.linalg.solve(L.conj().T, np.linalg.solve(L, b))
+
+    def greedy_select(self, n_columns: int, regularization: float = 0.0):
+        """Pick n_columns columns by orthogonal matching pursuit
+
+        Works on the normal equations alone. The correlation of the residual with every column is
+        X^H (y - X_S c_S) = X^H y - G[:, S] c_S, so each step costs O(K^2) no matter how many
+        samples were accumulated.
+
+        Returns:
+            Boolean mask of the selected columns
+        """
+        if not 0 < n_columns <= self.n_coeffs:
+            raise Exception("Must select between 1 and n_coeffs columns")
+        column_energy = np.maximum(self.gram.diagonal().real, np.finfo(float).tiny)
+        selected = []
+        coeffs = np.zeros(0, dtype=np.complex128)
+        for _ in range(n_columns):
+            residual_correlation = self.cross_correlation - self.gram[:, selected] @ coeffs
+            score = np.abs(residual_correlation)**2 / column_energy
+            score[selected] = -np.inf
+            selected.append(int(np.argmax(score)))
+            coeffs = self.solve_subset(selected, regularization)
+        mask = np.zeros(self.n_coeffs, dtype=bool)
+        mask[selected] = True
+        return mask
+
+
+class GainLookupTable:
+    """Memory polynomial compiled into per-tap complex gain tables, like a hardware LUT DPD
+
+    Without cross terms every memory tap of a MemoryPolynomial is a gain that only depends on the
+    envelope of its own delayed sample, y(n) = sum over m of x(n - m*stride) * G_m(|x(n - m*stride)|).
+    Each G_m is sampled on a uniform grid of n_entries points from 0 to max_amplitude (or from 0
+    to max_amplitude^2 with power indexing, which skips the square root and puts more entries
+    near the peak). Applying the table is one index computation per sample plus two np.take
+    calls per tap, so the cost does not depend on the polynomial order.
+
+    Envelopes above max_amplitude use the last entry, like a saturating hardware index.
+
+    A PowerAmp can be compiled too. Its IQ imbalance k1*x + k2*conj(x) is applied to the input
+    before the tables, like PowerAmp.transmit does. The random noise PowerAmp.transmit adds is not
+    part of the model, so the tables reproduce the noise-free PA.
+
+    Attributes:
+        polynomial: The MemoryPolynomial (or ILA_DPD or PowerAmp) the tables were compiled from
+        n_entries: Number of entries in each table
+        max_amplitude: Envelope of the last entry
+        indexing: 'amplitude' to index by |x| or 'power' to index by |x|^2
+        interpolate: Interpolate linearly between entries. Otherwise the nearest entry is used.
+        table_bits: Optional number of bits of the real and imaginary parts of every entry. The
+            entries are rounded to signed fixed point with the table's largest part at full scale.
+        tables: (memory_depth, n_entries) complex64 gains, the single precision words of a hardware table
+        slopes: (memory_depth, n_entries) difference to the next entry, 0 for the last one
+        k1, k2: IQ imbalance of a PowerAmp. 1 and 0 for other polynomials.
+        stream_state: Past input samples carried between transmit_block calls, after the IQ imbalance
+    """
+
+    def __init__(self, polynomial, n_entries: int = 256, max_amplitude: float = 1.0,
+                 indexing: str = 'amplitude', interpolate: bool = True, table_bits: int = None):
+        if polynomial.cross_terms:
+            raise Exception("Cross terms depend on two samples so they can not be compiled into per-tap tables")
+        if indexing not in LUT_INDEXING:
+            raise Exception(f"The indexing must be one of {LUT_INDEXING}")
+        if n_entries < 2:
+            raise Exception("The table needs at least 2 entries")
+        if max_amplitude <= 0:
+            raise Exception("The max amplitude must be positive")
+
+        self.polynomial = polynomial
+        self.n_entries = n_entries
+        self.max_amplitude = max_amplitude
+        self.indexing = indexing
+        self.interpolate = interpolate
+        self.table_bits = table_bits
+        self.k1 = getattr(polynomial, 'k1', 1)
+        self.k2 = getattr(polynomial, 'k2', 0)
+        self.tables = self.compile_tables().astype(np.complex64)
+        self.slopes = np.zeros_like(self.tables)
+        self.slopes[:, :-1] = np.diff(self.tables, axis=-1)
+        self.stream_state = None
+
+    def compile_tables(self):
+        """Sample the gain of every memory tap at the table's grid of envelopes"""
+        grid = np.linspace(0, 1, self.n_entries)
+        if self.indexing == 'power':
+            grid = np.sqrt(grid)
+        tables = self.gains(grid * self.max_amplitude)
+        if self.table_bits is not None:
+            tables = self.quantize(tables, self.table_bits)
+        return tables
+
+    def gains(self, amplitudes):
+        """Exact (memory_depth, len(amplitudes)) gains G_m(|x|) of the polynomial"""
+        poly = self.polynomial
+        magnitude = np.asarray(amplitudes, dtype=np.float64) / poly.envelope_scale
+        coeffs = np.where(poly.column_mask, poly.coeffs.flatten(), 0).reshape(poly.n_rows, poly.memory_depth)
+        envelopes = [np.array(envelope) for envelope in poly.envelope_polynomials(magnitude, poly.polynomial_transform)]
+        return coeffs.T @ np.array(envelopes)[poly.row_specs[:, 0]]
+
+    @staticmethod
+    def quantize(tables, n_bits: int):
+        """Round the real and imaginary parts to n_bits signed fixed point at the table's full scale"""
+        full_scale = max(np.max(np.abs(tables.real)), np.max(np.abs(tables.imag)))
+        if full_scale == 0:
+            return tables
+        step = full_scale / (2**(n_bits - 1) - 1)
+        return step * (np.round(tables.real / step) + 1j * np.round(tables.imag / step))
+
+    def transmit(self, x):
+        """Transmit a signal, or a 2-D (n_signals, n_samples) batch of signals, through the tables"""
+        return self.apply_tables(self.front_end(x))
+
+    def front_end(self, x):
+        """The IQ imbalance k1*x + k2*conj(x) of a PowerAmp. x itself for other polynomials."""
+        if self.k1 == 1 and self.k2 == 0:
+            return x
+        return self.k1*x + self.k2*np.conj(x)
+
+    def apply_tables(self, x, initial_state=None):
+        """Apply the tables to a signal or a 2-D (n_signals, n_samples) batch of signals
+
+        Args:
+            x: Input signal, after the front_end
+            initial_state: The state_length samples that preceded x. Zeros if not given.
+
+        Returns:
+            The output signal with the same shape as x
+        """
+        poly = self.polynomial
+        n_samples = x.shape[-1]
+        n_state = poly.state_length
+        # Single precision throughout, like the words of a hardware table
+        signal = np.zeros(x.shape[:-1] + (n_state + n_samples,), dtype=np.complex64)
+        if initial_state is not None:
+            signal[..., :n_state] = initial_state
+        signal[..., n_state:] = x
+
+        # The delayed replica of a sample reuses its index, so each index is computed once
+        index, fraction = self.table_positions(signal)
+        out = np.zeros(x.shape, dtype=np.complex64)
+        gain = np.empty(x.shape, dtype=np.complex64)
+        scratch = np.empty(x.shape, dtype=np.complex64)
+        for tap in np.flatnonzero(poly.column_mask.reshape(poly.n_rows, poly.memory_depth).any(axis=0)):
+            start = n_state - tap * poly.memory_stride
+            window = slice(start, start + n_samples)
+            # The indexes are already clipped to the table so mode='clip' skips the bounds check
+            np.take(self.tables[tap], index[..., window], out=gain, mode='clip')
+            if fraction is not None:
+                np.take(self.slopes[tap], index[..., window], out=scratch, mode='clip')
+                scratch *= fraction[..., window]
+                gain += scratch
+            gain *= signal[..., window]
+            out += gain
+        return out
+
+    def table_positions(self, x):
+        """Returns the table index of every sample and its fraction of the way to the next entry
+
+        The fraction is None without interpolation, where the index is the nearest entry.
+        """
+        envelope = x.real**2 + x.imag**2
+        if self.indexing == 'amplitude':
+            position = np.sqrt(envelope) * ((self.n_entries - 1) / self.max_amplitude)
+        else:
+            position = envelope * ((self.n_entries - 1) / self.max_amplitude**2)
+        np.minimum(position, self.n_entries - 1, out=position)
+        if not self.interpolate:
+            return np.rint(position).astype(np.intp), None
+        index = position.astype(np.intp)
+        return index, position - index
+
+    def lookup(self, amplitudes):
+        """(memory_depth, len(amplitudes)) gains the tables give at each envelope"""
+        index, fraction = self.table_positions(np.asarray(amplitudes, dtype=np.float64))
+        gains = np.take(self.tables, index, axis=-1)
+        if fraction is not None:
+            gains += fraction * np.take(self.slopes, index, axis=-1)
+        return gains
+
+    def transmit_block(self, x):
+        """Transmit one block of a longer signal. See MemoryPolynomial.transmit_block."""
+        x = self.front_end(x)
+        y = self.apply_tables(x, initial_state=self.stream_state)
+        self.stream_state = self.polynomial.carry_state(self.stream_state, x)
+        return y
+
+    def reset_stream(self):
+        """Forget the memory carried between transmit_block calls"""
+        self.stream_state = None
+
+    def approximation_error(self, x):
+        """Compare the tables to the polynomial they were compiled from
+
+        Args:
+            x: Test signal, e.g. the signal the polynomial was trained on
+
+        Returns:
+            A dict with
+            - 'nmse': NMSE of the table output against the noise-free polynomial, i.e.
+              MemoryPolynomial.apply_branches after the same front_end
+            - 'max_gain_error': Largest |G_m(r) - table gain| over a grid 16 times finer than the
+              table, from 0 to max_amplitude
+            - 'clipped_fraction': Fraction of the samples above max_amplitude at the table input
+        """
+        x = self.front_end(x)
+        fine = np.linspace(0, self.max_amplitude, 16 * (self.n_entries - 1) + 1)
+        return {'nmse': nmse(MemoryPolynomial.apply_branches(self.polynomial, x), self.apply_tables(x), axis=None),
+                'max_gain_error': np.max(np.abs(self.gains(fine) - self.lookup(fine))),
+                'clipped_fraction': np.mean(np.abs(x) > self.max_amplitude)}
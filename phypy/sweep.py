@@ -0,0 +1,142 @@
+"""Module for running PA/DPD parameter sweeps in parallel
+
+Every combination of OFDM bandwidth, PA configuration and ILA DPD parameters is run as one case
+in a process pool. The OFDM waveform of each bandwidth is generated once and shared with the
+workers through shared memory, and every case gets its own child seed so the results do not
+depend on the number of workers or the order the cases finish in.
+
+Running a sweep needs multiprocessing.shared_memory (Python 3.8+). It is imported when a sweep
+runs, so the module itself still imports on older interpreters.
+"""
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+try:
+    from .analog import PowerAmp
+    from .corrections import ILA_DPD
+    from .modulators import OFDM
+    from .rng import spawn
+    from .metrics import aclr
+except:
+    from analog import PowerAmp
+    from corrections import ILA_DPD
+    from modulators import OFDM
+    from rng import spawn
+    from metrics import aclr
+
+RESULT_DTYPE = np.dtype([('n_subcarriers', '<i8'),
+                         ('pa_index', '<i8'),
+                         ('order', '<i8'),
+                         ('memory_depth', '<i8'),
+                         ('memory_stride', '<i8'),
+                         ('n_iterations', '<i8'),
+                         ('nmse', '<f8'),
+                         ('evm', '<f8'),
+                         ('aclr', '<f8')])
+
+
+class Sweep:
+    """Grid of PA/DPD/OFDM experiments run over a ProcessPoolExecutor
+
+    Attributes:
+        pa_configs: List of keyword argument dicts for PowerAmp. The seed is set per case.
+        dpd_grid: Dict mapping ILA_DPD argument names to lists of values. Every combination is run.
+        n_subcarriers: List of OFDM bandwidths (number of subcarriers) to test
+        n_symbols: Number of OFDM symbols in each test waveform
+        drive_scale: Gain applied to the OFDM waveform before the DPD and PA
+        seed: Root seed. Each case gets a child of it.
+        max_workers: Number of worker processes. Defaults to the number of CPUs.
+    """
+
+    def __init__(self, pa_configs=None, dpd_grid=None, n_subcarriers=(1200,), n_symbols: int = 14,
+                 drive_scale: float = 15, seed: int = 0, max_workers: int = None):
+        self.pa_configs = [{}] if pa_configs is None else list(pa_configs)
+        self.dpd_grid = {} if dpd_grid is None else dict(dpd_grid)
+        self.n_subcarriers = list(n_subcarriers)
+        self.n_symbols = n_symbols
+        self.drive_scale = drive_scale
+        self.seed = seed
+        self.max_workers = max_workers
+
+    def dpd_configs(self):
+        """List of keyword argument dicts for ILA_DPD, one per point of dpd_grid"""
+        names = list(self.dpd_grid)
+        return [dict(zip(names, values)) for values in itertools.product(*self.dpd_grid.values())]
+
+    def run(self):
+        """Run every case of the sweep
+
+        Returns:
+            A structured array with one RESULT_DTYPE row per case
+        """
+        dpd_configs = self.dpd_configs()
+        n_cases = len(self.n_subcarriers) * len(self.pa_configs) * len(dpd_configs)
+        case_seeds = iter(spawn(self.seed, n_cases))
+
+        shared_blocks = []
+        cases = []
+        try:
+            for n_subcarriers in self.n_subcarriers:
+                ofdm = OFDM(n_subcarriers=n_subcarriers, seed=self.seed)
+                signal = ofdm.use(self.n_symbols) * self.drive_scale
+                signal_info = _share_array(signal, shared_blocks)
+                fd_symbols_info = _share_array(ofdm.fd_symbols, shared_blocks)
+                for pa_index, pa_config in enumerate(self.pa_configs):
+                    for dpd_config in dpd_configs:
+                        cases.append((n_subcarriers, signal_info, fd_symbols_info, self.drive_scale, pa_index,
+                                      pa_config, dpd_config, next(case_seeds)))
+
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                rows = list(executor.map(_run_case, *zip(*cases)))
+        finally:
+            for block in shared_blocks:
+                block.close()
+                block.unlink()
+
+        return np.array(rows, dtype=RESULT_DTYPE)
+
+
+def _share_array(array, shared_blocks):
+    """Copy an array into a new shared memory block and return what a worker needs to attach"""
+    from multiprocessing import shared_memory
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared_blocks.append(block)
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block.name, array.shape, array.dtype.str
+
+
+def _run_case(n_subcarriers, signal_info, fd_symbols_info, drive_scale, pa_index, pa_config, dpd_config,
+              seed_sequence):
+    """Attach to the shared waveform and run one case. Runs in a worker process."""
+    from multiprocessing import shared_memory
+    signal_block = shared_memory.SharedMemory(name=signal_info[0])
+    fd_symbols_block = shared_memory.SharedMemory(name=fd_symbols_info[0])
+    try:
+        # The views into the shared blocks only live inside _score_case so the blocks can be closed
+        return _score_case(n_subcarriers, (signal_block, *signal_info[1:]),
+                           (fd_symbols_block, *fd_symbols_info[1:]), drive_scale, pa_index, pa_config,
+                           dpd_config, seed_sequence)
+    finally:
+        signal_block.close()
+        fd_symbols_block.close()
+
+
+def _score_case(n_subcarriers, signal_info, fd_symbols_info, drive_scale, pa_index, pa_config, dpd_config,
+                seed_sequence):
+    """Learn a DPD for one PA and score the linearized output"""
+    signal = np.ndarray(signal_info[1], dtype=signal_info[2], buffer=signal_info[0].buf)
+    ofdm = OFDM(n_subcarriers=n_subcarriers)
+    ofdm.fd_symbols = np.ndarray(fd_symbols_info[1], dtype=fd_symbols_info[2], buffer=fd_symbols_info[0].buf)
+
+    pa = PowerAmp(**dict(pa_config, seed=seed_sequence))
+    dpd = ILA_DPD(**dpd_config)
+    dpd.perform_learning(pa, signal)
+    pa_output = pa.transmit(dpd.transmit(signal))
+    pa_output *= np.linalg.norm(signal) / np.linalg.norm(pa_output)
+
+    nmse = PowerAmp.calculate_nmse(signal, pa_output)
+    _, evm = ofdm.demodulate(pa_output / drive_scale)
+    worst_aclr = np.max(aclr(pa_output, ofdm))
+    return (n_subcarriers, pa_index, dpd.order, dpd.memory_depth, dpd.memory_stride, dpd.n_iterations,
+            nmse, evm, worst_aclr)
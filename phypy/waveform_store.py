@@ -0,0 +1,112 @@
+"""Module for storing waveforms on disk as memory-mapped complex64 files
+
+A waveform file is a fixed size header followed by the raw complex64 samples. Opening a file
+maps the samples with np.memmap so multi-gigabyte captures can be processed block by block
+without loading them and can be shared between processes without copies.
+"""
+import numpy as np
+
+MAGIC = b'PHYPYWF1'
+HEADER_SIZE = 64  # Bytes reserved for the header. The samples start at this offset.
+HEADER_DTYPE = np.dtype([('magic', 'S8'),
+                         ('sampling_rate', '<f8'),
+                         ('fft_size', '<i8'),
+                         ('cp_length', '<i8'),
+                         ('seed', '<i8'),
+                         ('n_samples', '<i8')])
+
+
+class Waveform:
+    """A waveform file opened as a memory map
+
+    Attributes:
+        path: Location of the file
+        samples: The complex64 samples as an np.memmap
+        sampling_rate: Sampling rate of the samples in Hz
+        fft_size: FFT size of the OFDM modulator that made the waveform. 0 if not OFDM.
+        cp_length: Cyclic prefix length of that modulator
+        seed: Seed used to generate the waveform
+    """
+
+    def __init__(self, path, samples, sampling_rate, fft_size=0, cp_length=0, seed=0):
+        self.path = path
+        self.samples = samples
+        self.sampling_rate = sampling_rate
+        self.fft_size = fft_size
+        self.cp_length = cp_length
+        self.seed = seed
+
+    @property
+    def n_samples(self):
+        return self.samples.size
+
+    def flush(self):
+        """Write any changes to the samples to disk"""
+        self.samples.flush()
+
+
+def create_waveform(path, n_samples: int, sampling_rate: float, fft_size: int = 0, cp_length: int = 0,
+                    seed: int = 0):
+    """Create a new waveform file of n_samples zeros to be filled in place
+
+    Args:
+        path: Where to create the file. Overwritten if it exists.
+        n_samples: Number of complex samples the file holds
+        sampling_rate: Sampling rate of the samples in Hz
+        fft_size: FFT size of the OFDM modulator that makes the waveform
+        cp_length: Cyclic prefix length of the OFDM modulator
+        seed: Seed used to generate the waveform
+
+    Returns:
+        A Waveform whose samples are a writable memory map
+    """
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header['magic'] = MAGIC
+    header['sampling_rate'] = sampling_rate
+    header['fft_size'] = fft_size
+    header['cp_length'] = cp_length
+    header['seed'] = seed
+    header['n_samples'] = n_samples
+    with open(path, 'wb') as f:
+        f.write(header.tobytes().ljust(HEADER_SIZE, b'\0'))
+        f.truncate(HEADER_SIZE + n_samples * np.dtype(np.complex64).itemsize)
+    return open_waveform(path, mode='r+')
+
+
+def save_waveform(path, signal, sampling_rate: float, fft_size: int = 0, cp_length: int = 0, seed: int = 0,
+                  block_size: int = 2**20):
+    """Save a 1-D signal to a waveform file
+
+    The signal is copied block by block so it may itself be a memory map or any array-like that
+    supports slicing.
+
+    Returns:
+        The saved Waveform opened for reading
+    """
+    waveform = create_waveform(path, signal.shape[-1], sampling_rate, fft_size, cp_length, seed)
+    for start in range(0, waveform.n_samples, block_size):
+        waveform.samples[start:start + block_size] = signal[start:start + block_size]
+    waveform.flush()
+    return open_waveform(path)
+
+
+def open_waveform(path, mode: str = 'r'):
+    """Open a waveform file without reading the samples into memory
+
+    Args:
+        path: The waveform file
+        mode: np.memmap mode. 'r' for read-only, 'r+' to modify the samples in place,
+            'c' for copy-on-write
+
+    Returns:
+        A Waveform whose samples are an np.memmap
+    """
+    with open(path, 'rb') as f:
+        header = np.frombuffer(f.read(HEADER_DTYPE.itemsize), dtype=HEADER_DTYPE)
+    if header.size != 1 or header['magic'][0] != MAGIC:
+        raise Exception(f"{path} is not a phypy waveform file")
+
+    samples = np.memmap(path, dtype=np.complex64, mode=mode, offset=HEADER_SIZE,
+                        shape=(int(header['n_samples'][0]),))
+    return Waveform(path, samples, float(header['sampling_rate'][0]), int(header['fft_size'][0]),
+                    int(header['cp_length'][0]), int(header['seed'][0]))
@@ -10,8 +10,17 @@ from click.testing import CliRunner
 
 from phypy import cli
 from phypy import analog
+from phypy import corrections
 from phypy import modulators as mods
 from phypy import dsp
+from phypy import metrics
+from phypy import rng
+from phypy import structures
+from phypy import sweep
+from phypy import waveform_store
+from phypy.mimo import channels
+from phypy.mimo import mimo
+from phypy.mimo import precoders
 
 
 
@@ -52,6 +61,19 @@ def test_pa_setup():
     assert pa.k2 == 0
 
 
+def test_pa_owns_its_random_stream():
+    """The PA should leave the global RNG alone and reproduce its noise from its seed"""
+    x = np.ones(100, dtype=np.complex64)
+    global_state = np.random.get_state()[1].copy()
+    first = analog.PowerAmp(seed=3).transmit(x)
+    assert np.array_equal(np.random.get_state()[1], global_state)
+    assert np.array_equal(analog.PowerAmp(seed=3).transmit(x), first)
+
+    children = rng.spawn(3, 2)
+    assert not np.allclose(analog.PowerAmp(seed=children[0]).transmit(x),
+                           analog.PowerAmp(seed=children[1]).transmit(x))
+
+
 def test_pa_transmission_with_unit_coeff():
     """Test that the pa output is equal to the pa input if there is only a 1 in the 1st order term"""
     pa = analog.PowerAmp(order=7, noise_variance=0, add_iq_imbalance=False, add_lo_leakage=False)
@@ -61,6 +83,211 @@ def test_pa_transmission_with_unit_coeff():
     assert sum(np.abs(pa.transmit(x) - x)) <= 1e-5
 
 
+@pytest.mark.parametrize('dtype', [np.complex64, np.complex128])
+def test_basis_matrix_matches_reference_loop(dtype):
+    """The vectorized basis matrix should match the original insert/resize construction bit for bit"""
+    poly = structures.MemoryPolynomial(order=7, memory_depth=4, memory_stride=2)
+    x = (np.exp(1j * (2 * np.pi * 1e6 * np.arange(100)/10e6)) * np.linspace(0.1, 1.5, 100)).astype(dtype)
+    expected = np.zeros((x.size, poly.n_coeffs), dtype=np.complex64)
+    column_index = 0
+    for order in range(1, poly.order + 1, 2):
+        branch = np.multiply(x, np.power(np.abs(x), (order - 1)))
+        for tap in range(0, poly.memory_depth):
+            delay = tap * poly.memory_stride
+            expected[:, column_index] = np.resize(np.insert(branch, 0, np.zeros(delay)), branch.size)
+            column_index += 1
+
+    assert np.array_equal(poly.setup_basis_matrix(x), expected)
+    buffer = np.ones((x.size, poly.n_coeffs), dtype=np.complex64, order='F')
+    assert poly.setup_basis_matrix(x, out=buffer) is buffer
+    assert np.array_equal(buffer, expected)
+
+
+def test_streaming_transmit_matches_one_shot():
+    """Block-wise transmission should carry the memory and reproduce a single transmit call"""
+    poly = structures.MemoryPolynomial(order=5, memory_depth=4, memory_stride=3)
+    poly.coeffs = np.arange(1, poly.n_coeffs + 1).reshape(poly.coeffs.shape) * (0.1 - 0.05j)
+    x = np.exp(1j * (2 * np.pi * 1e6 * np.arange(1000)/10e6)) * np.linspace(0.1, 1.5, 1000)
+    expected = poly.transmit(x)
+    assert np.array_equal(np.concatenate(list(poly.transmit_stream(x, block_size=7))), expected)
+    blocks = [x[:5], x[5:400], x[400:]]
+    assert np.array_equal(np.concatenate(list(poly.transmit_stream(blocks))), expected)
+
+    pa = analog.PowerAmp(order=7, noise_variance=0, add_lo_leakage=False)
+    assert np.array_equal(np.concatenate(list(pa.transmit_stream(x, block_size=64))), pa.transmit(x))
+
+
+def test_direct_apply_matches_basis_matrix_product():
+    """Filtering the branches directly should give the basis matrix times the coeffs"""
+    poly = structures.MemoryPolynomial(order=7, memory_depth=4, memory_stride=3)
+    poly.coeffs = np.arange(1, poly.n_coeffs + 1).reshape(poly.coeffs.shape) * (0.1 - 0.05j)
+    x = np.exp(1j * (2 * np.pi * 1e6 * np.arange(500)/10e6)) * np.linspace(0.1, 1.5, 500)
+    expected = np.dot(poly.setup_basis_matrix(x), poly.coeffs.flatten())
+    # Both are single precision accurate but the per-tap gains round differently than the basis columns
+    assert np.allclose(poly.transmit(x), expected, rtol=0, atol=2e-6 * np.max(np.abs(expected)))
+
+
+def test_basis_families_and_cross_terms():
+    """Every family should build the documented columns and stream like the odd basis"""
+    x = np.exp(1j * (2 * np.pi * 1e6 * np.arange(300)/10e6)) * np.linspace(0.1, 1, 300)
+    poly = structures.MemoryPolynomial(order=3, memory_depth=2, memory_stride=2, basis='full', cross_terms=1)
+    assert poly.n_rows == 1 + 3 * 2 and poly.state_length == 4
+
+    def delayed(signal, delay):
+        return np.concatenate((np.zeros(delay), signal[:signal.size - delay]))
+
+    expected = []
+    for order in (1, 2, 3):
+        delays = [(0, 0)] if order == 1 else [(0, 0), (0, 2), (2, 0)]
+        for signal_delay, envelope_delay in delays:
+            branch = delayed(x, signal_delay) * np.abs(delayed(x, envelope_delay))**(order - 1)
+            expected += [delayed(branch, 0), delayed(branch, 2)]
+    assert np.allclose(poly.setup_basis_matrix(x), np.stack(expected, axis=-1), rtol=1e-6, atol=1e-7)
+
+    orthogonal = structures.MemoryPolynomial(order=5, memory_depth=2, basis='orthogonal', cross_terms=1)
+    monomial = orthogonal.setup_basis_matrix(x, monomial=True)
+    column_transform = np.kron(orthogonal.row_transform.T, np.identity(2))
+    assert np.allclose(orthogonal.setup_basis_matrix(x), monomial @ column_transform, rtol=1e-4, atol=1e-4)
+    assert np.allclose(orthogonal.setup_basis_matrix(0.8 * x), monomial @ orthogonal.gain_transform(0.8),
+                       rtol=1e-4, atol=1e-4)
+
+    # The orthogonal polynomials are far better conditioned than the plain powers they span
+    full = structures.MemoryPolynomial(order=5, memory_depth=1, basis='full')
+    orthogonal = structures.MemoryPolynomial(order=5, memory_depth=1, basis='orthogonal')
+    assert (np.linalg.cond(orthogonal.setup_basis_matrix(x).astype(complex))
+            < np.linalg.cond(full.setup_basis_matrix(x).astype(complex)) / 100)
+
+    poly = structures.MemoryPolynomial(order=5, memory_depth=3, memory_stride=2, basis='orthogonal', cross_terms=2)
+    poly.coeffs = np.arange(1, poly.n_coeffs + 1).reshape(poly.coeffs.shape) * (0.01 - 0.005j)
+    assert np.array_equal(np.concatenate(list(poly.transmit_stream(x, block_size=7))), poly.transmit(x))
+    assert np.allclose(poly.transmit(x), poly.setup_basis_matrix(x) @ poly.coeffs.flatten(), atol=1e-5)
+
+
+def test_omp_pruning_finds_sparse_model():
+    """Greedy selection should find the few columns that make up the output and transmit only those"""
+    x = (np.random.RandomState(0).randn(3000) + 1j*np.random.RandomState(1).randn(3000)) / 2
+    true_model = structures.MemoryPolynomial(order=5, memory_depth=4, cross_terms=1)
+    support = [0, 5, 19]
+    true_model.coeffs = true_model.coeffs.astype(complex)
+    true_model.coeffs.flat[support] = [1, 0.2 - 0.1j, -0.05j]
+    y = true_model.transmit(x)
+
+    poly = structures.MemoryPolynomial(order=5, memory_depth=4, cross_terms=1, regularization=0)
+    mask = poly.prune(x, y, n_columns=3)
+    assert np.flatnonzero(mask).tolist() == support
+    assert np.allclose(poly.coeffs, true_model.coeffs, atol=1e-5)
+    assert np.allclose(poly.transmit(x), y, atol=1e-5)
+    assert np.allclose(poly.perform_least_squares(x, y)[~mask], 0)
+
+
+def test_ila_dpd_is_basis_independent():
+    """The odd and orthogonal families span the same models, so ILA should learn the same DPD"""
+    pa = analog.PowerAmp(noise_variance=0, add_iq_imbalance=False, add_lo_leakage=False)
+    x = (np.random.RandomState(0).randn(4000) + 1j*np.random.RandomState(1).randn(4000)) / 4
+    full = corrections.ILA_DPD(order=5, memory_depth=2, memory_stride=1, basis='full')
+    orthogonal = corrections.ILA_DPD(order=5, memory_depth=2, memory_stride=1, basis='orthogonal')
+    full.regularization = orthogonal.regularization = 0
+    full.perform_learning(pa, x)
+    orthogonal.perform_learning(pa, x)
+    assert np.allclose(full.transmit(x), orthogonal.transmit(x), atol=1e-3)
+
+
+def test_blockwise_least_squares_recovers_coeffs():
+    """The accumulated normal equations should recover a noiseless PA regardless of block size"""
+    pa = analog.PowerAmp(order=5, memory_depth=3, noise_variance=0, add_iq_imbalance=False,
+                         add_lo_leakage=False)
+    pa.regularization = 0
+    x = (np.random.RandomState(0).randn(2000) + 1j*np.random.RandomState(1).randn(2000)) / 2
+    y = pa.transmit(x)
+    one_block = pa.perform_least_squares(x, y, block_size=x.size)
+    assert np.allclose(one_block, pa.coeffs.flatten(), atol=1e-4)
+    assert np.allclose(pa.perform_least_squares(x, y, block_size=97), one_block, atol=1e-5)
+
+    first = pa.accumulate_least_squares([x[:1000]], [y[:1000]])
+    second = pa.accumulate_least_squares([x[1000:]], [y[1000:]])
+    merged = first.merge(second)
+    assert merged.n_samples == x.size
+    assert np.allclose(merged.solve(), one_block, atol=1e-3)
+
+
+@pytest.mark.parametrize('dpd', [corrections.RLS_DPD(block_size=256),
+                                 corrections.NLMS_DPD(n_iterations=20, step_size=1),
+                                 corrections.RLS_DPD(block_size=256, basis='orthogonal', cross_terms=1),
+                                 corrections.NLMS_DPD(n_iterations=20, step_size=1, basis='full')])
+def test_adaptive_dpd_linearizes_pa(dpd):
+    """Online adaptation should reduce the error of a compressive PA"""
+    pa = analog.PowerAmp(noise_variance=0, add_iq_imbalance=False, add_lo_leakage=False)
+    pa.coeffs = np.zeros(shape=pa.coeffs.shape, dtype=np.complex64)
+    pa.coeffs[0, 0] = 2
+    pa.coeffs[1, 0] = -0.3
+    x = (np.random.RandomState(0).randn(4000) + 1j*np.random.RandomState(1).randn(4000)) / 6
+
+    def linearization_error(y):
+        return analog.PowerAmp.calculate_nmse(x, y*np.linalg.norm(x)/np.linalg.norm(y))
+
+    error_without_dpd = linearization_error(pa.transmit(x))
+    dpd.perform_learning(pa, x)
+    assert linearization_error(pa.transmit(dpd.transmit(x))) < error_without_dpd / 100
+
+
+@pytest.mark.parametrize('dpd', [corrections.RLS_DPD(block_size=500), corrections.NLMS_DPD(block_size=500, step_size=1)])
+def test_adaptive_dpd_tracks_pa_gain_change(dpd):
+    """The gain estimate should forget the old PA when the PA gain changes mid-stream"""
+    pa = analog.PowerAmp(noise_variance=0, add_iq_imbalance=False, add_lo_leakage=False)
+    pa.coeffs = np.zeros(shape=pa.coeffs.shape, dtype=np.complex64)
+    pa.coeffs[0, 0] = 2
+    pa.coeffs[1, 0] = -0.3
+    x = (np.random.RandomState(0).randn(20000) + 1j*np.random.RandomState(1).randn(20000)) / 6
+    for block in np.split(x, 40):
+        dpd.learn_block(pa, block)
+    assert np.isclose(np.sqrt(dpd.input_energy / dpd.output_energy), 0.5, rtol=0.05)
+
+    pa.coeffs /= 2
+    for _ in range(3):
+        for block in np.split(x, 40):
+            dpd.learn_block(pa, block)
+    assert np.isclose(np.sqrt(dpd.input_energy / dpd.output_energy), 1, rtol=0.05)
+    assert np.isclose(dpd.coeffs[0, 0], 1, atol=0.05)
+    y = pa.transmit(dpd.transmit(x))
+    assert analog.PowerAmp.calculate_nmse(x, y*np.linalg.norm(x)/np.linalg.norm(y)) < 1e-4
+
+
+def test_cfr_reduces_papr_without_regrowth():
+    """Clipping and filtering should hit the PAPR target and keep every signal in band"""
+    ofdm = mods.OFDM(n_subcarriers=300, cp_length=36)
+    signals = np.stack([mods.OFDM(n_subcarriers=300, cp_length=36, seed=seed).use(14) for seed in range(3)])
+    cfr = corrections.CFR(ofdm, target_papr=7, n_iterations=6)
+    out, papr, ccdf = cfr.process(signals)
+    assert out.shape == signals.shape
+    assert np.all(metrics.papr(signals) > 8.5)
+    assert np.all(papr < 7.5)
+    assert ccdf.shape == (3, cfr.ccdf_thresholds.size)
+    assert np.all(ccdf[:, cfr.ccdf_thresholds >= 7.5] == 0)
+
+    # Nothing lands outside the occupied subcarriers and the CP is still a copy of the symbol end
+    symbols = out.reshape(3, 14, 512 + 36)
+    assert np.allclose(symbols[..., :36], symbols[..., -36:])
+    spectrum = np.fft.fft(symbols[..., 36:], axis=-1)
+    unused = np.setdiff1d(np.arange(512), ofdm.subcarrier_bins)
+    assert np.max(np.abs(spectrum[..., unused])) < 1e-4 * np.max(np.abs(spectrum))
+    assert np.allclose(cfr.process(signals[1])[0], out[1], atol=1e-6)
+
+
+def test_batched_pa_transmit():
+    """Each row of a batch should match a single-signal transmit and get its own noise"""
+    pa = analog.PowerAmp(order=7, memory_stride=2, noise_variance=0, add_lo_leakage=False)
+    x = np.exp(1j * (2 * np.pi * 1e6 * np.arange(300)/10e6)) * np.linspace(0.1, 1.5, 300)
+    batch = np.stack((x, 0.5*x, x[::-1]))
+    y = pa.transmit(batch)
+    assert y.shape == batch.shape
+    for row, expected_row in zip(y, batch):
+        assert np.array_equal(row, pa.transmit(expected_row))
+
+    pa.noise_variance = 0.01
+    noisy = pa.transmit(np.stack((x, x)))
+    assert not np.allclose(noisy[0], noisy[1])
+
+
 def test_ofdm_setup_lte_20mhz():
     """Test the default setup of the OFDM class"""
     ofdm = mods.OFDM()
@@ -72,6 +299,15 @@ def test_ofdm_setup_lte_20mhz():
     assert (ofdm.symbol_alphabet == np.array([-1+1j, -1-1j, 1+1j, 1-1j])).all()
 
 
+def test_ofdm_rejects_cyclic_prefix_longer_than_symbol():
+    """A cyclic prefix longer than the FFT would have to copy samples that do not exist"""
+    with pytest.raises(Exception):
+        mods.OFDM(n_subcarriers=72)
+    ofdm = mods.OFDM(n_subcarriers=72, cp_length=128)
+    x = ofdm.use(2).reshape(2, -1)
+    assert np.array_equal(x[:, :128], x[:, 128:])
+
+
 def test_ofdm_setup_lte_5mhz():
     """Test the default setup of the OFDM class"""
     ofdm = mods.OFDM(n_subcarriers=300)
@@ -83,6 +319,162 @@ def test_ofdm_setup_lte_5mhz():
     assert (ofdm.symbol_alphabet == np.array([-1+1j, -1-1j, 1+1j, 1-1j])).all()
 
 
+def test_ofdm_batched_use_matches_symbol_loop():
+    """The single batched IFFT should give the same waveform as modulating symbol by symbol"""
+    ofdm = mods.OFDM(n_subcarriers=300, constellation='16QAM')
+    x = ofdm.use(n_symbols=5)
+    expected = np.concatenate([ofdm.add_cyclic_prefix(ofdm.frequency_to_time_domain(symbol))
+                               for symbol in ofdm.fd_symbols.T])
+    assert x.dtype == np.complex64
+    assert np.array_equal(x, expected)
+
+    fd_symbols, evm = ofdm.demodulate(x)
+    assert evm < 1e-4
+
+
+def test_ofdm_subcarrier_mapping_plan():
+    """Positive subcarriers start right after DC and negative ones fill the end of the IFFT"""
+    ofdm = mods.OFDM(n_subcarriers=300)
+    assert ofdm.subcarrier_bins[:150].tolist() == list(range(512 - 150, 512))
+    assert ofdm.subcarrier_bins[150:].tolist() == list(range(1, 151))
+
+
+@pytest.mark.parametrize('constellation', ['QPSK', '16QAM', '64QAM'])
+def test_batched_receive_equalizes_and_demaps(constellation):
+    """A batch of frames through multipath should equalize back to the transmitted points"""
+    taps = np.array([1, 0.5 - 0.3j, 0.2j])
+    frames, references = [], []
+    for seed in range(3):
+        ofdm = mods.OFDM(n_subcarriers=72, cp_length=16, constellation=constellation, seed=seed)
+        frames.append(np.convolve(ofdm.use(n_symbols=4), taps)[:4 * (128 + 16)])
+        references.append(ofdm.fd_symbols)
+    frames, references = np.stack(frames), np.stack(references)
+    channel_response = np.fft.fft(taps, ofdm.fft_size)[ofdm.subcarrier_bins]
+
+    received = ofdm.receive(frames, channel_response)
+    assert received.shape == (3, 72, 4)
+    assert np.allclose(received, references, atol=1e-4)
+
+    indices, bits = ofdm.demap(received + 0.1 * (1 - 1j))
+    assert np.array_equal(ofdm.symbol_alphabet[indices], references)
+    llrs = ofdm.demap_llr(received + 0.1 * (1 - 1j), noise_variance=0.01 / np.abs(channel_response[:, np.newaxis])**2)
+    assert llrs.shape == (3, 72, 4, ofdm.bits_per_symbol)
+    assert np.array_equal(llrs < 0, bits.astype(bool))
+
+    link = ofdm.link_metrics(references, received)
+    assert link['evm_per_frame'].shape == (3,)
+    assert link['evm_per_subcarrier'].shape == (72,)
+    assert np.all(link['evm_per_frame'] < 1e-2)
+    assert np.all(link['ber_per_subcarrier'] == 0)
+
+    noisy = received + 0.5 * np.random.RandomState(0).randn(*received.shape)
+    ber = ofdm.link_metrics(references, noisy)['ber_per_frame']
+    assert np.all(ber > 0) and np.all(ber < 0.5)
+
+
+@pytest.mark.parametrize('constellation', ['QPSK', '16QAM', '64QAM'])
+def test_bit_payload_round_trip(constellation):
+    """Packed bytes should survive Gray mapping, modulation, reception and repacking"""
+    ofdm = mods.OFDM(n_subcarriers=72, cp_length=16, constellation=constellation)
+    payload = np.random.RandomState(0).randint(0, 256, size=1000, dtype=np.uint8)
+    x = ofdm.use_bits(payload)
+    n_symbols = -(-payload.size * 8 // (72 * ofdm.bits_per_symbol))
+    assert ofdm.fd_symbols.shape == (72, n_symbols)
+    assert x.size == n_symbols * (128 + 16)
+    assert np.array_equal(ofdm.label_points[ofdm.bits_to_labels(ofdm.bit_labels.ravel())], ofdm.symbol_alphabet)
+
+    received = ofdm.receive(np.stack((x, x)))
+    assert np.array_equal(ofdm.symbols_to_bytes(received, payload.size), np.stack((payload, payload)))
+    assert np.array_equal(ofdm.bits_to_symbols(payload.tobytes()), ofdm.fd_symbols)
+
+
+@pytest.mark.parametrize('backend', ['scipy', 'pyfftw'])
+def test_ofdm_fft_backends(backend):
+    """Other FFT backends should give the numpy waveform and demodulate back to the symbols"""
+    pytest.importorskip(backend)
+    expected = mods.OFDM(n_subcarriers=300).use(n_symbols=4)
+    ofdm = mods.OFDM(n_subcarriers=300, fft_backend=backend, fft_workers=2)
+    x = ofdm.use(n_symbols=4)
+    assert np.allclose(x, expected, atol=1e-6)
+    assert ofdm.demodulate(ofdm.use(n_symbols=4))[1] < 1e-4
+
+
+def test_ofdm_stream_through_pa_and_demodulator():
+    """A streamed waveform should demodulate from arbitrary chunks with a running EVM"""
+    ofdm = mods.OFDM(n_subcarriers=300, constellation='16QAM')
+    pa = analog.PowerAmp(order=1, memory_depth=1, noise_variance=0, add_iq_imbalance=False,
+                         add_lo_leakage=False)
+    pa.coeffs = np.ones(pa.coeffs.shape, dtype=np.complex64)
+    demodulator = mods.OFDMStreamDemodulator(ofdm)
+    pa_output = np.concatenate(list(pa.transmit_stream(ofdm.stream(symbols_per_block=3, n_blocks=4))))
+
+    fd_symbols = [demodulator.process(chunk) for chunk in np.array_split(pa_output, 7)]
+    assert demodulator.n_symbols == 12
+    assert np.concatenate(fd_symbols, axis=1).shape == (300, 12)
+    assert demodulator.evm < 1e-4
+
+
+def test_memmapped_waveform_learning(tmp_path):
+    """DPD learning and PA modeling should read memory-mapped waveforms in blocks"""
+    ofdm = mods.OFDM(n_subcarriers=300, cp_length=36)
+    waveform = ofdm.write_waveform(tmp_path / 'ofdm.wf', n_symbols=10, symbols_per_block=4)
+    assert isinstance(waveform.samples, np.memmap)
+    assert waveform.n_samples == 10 * (512 + 36)
+    assert (waveform.fft_size, waveform.cp_length, waveform.sampling_rate) == (512, 36, ofdm.sampling_rate)
+    in_memory = np.concatenate(list(ofdm.stream(symbols_per_block=10, n_blocks=1)))
+    assert np.array_equal(waveform.samples, in_memory)
+    assert np.array_equal(waveform.samples, ofdm.use(10))
+    assert ofdm.demodulate(waveform.samples)[1] < 1e-4
+
+    x = waveform.samples * 15
+    pa = analog.PowerAmp(noise_variance=0, add_iq_imbalance=False, add_lo_leakage=False)
+    expected_dpd = corrections.ILA_DPD()
+    expected_dpd.perform_learning(pa, x, block_size=x.size)
+    dpd = corrections.ILA_DPD()
+    dpd.perform_learning(pa, x, block_size=1000)
+    assert np.allclose(dpd.coeffs, expected_dpd.coeffs, atol=1e-5)
+
+    pa_output = waveform_store.save_waveform(tmp_path / 'pa_output.wf', pa.transmit(waveform.samples),
+                                             ofdm.sampling_rate)
+    pa.make_new_model(waveform.samples, pa_output.samples, block_size=1000)
+    assert pa.nmse_of_fit < 1e-6
+
+
+def test_parallel_sweep_is_reproducible():
+    """Each case should get its own seed so results do not depend on the number of workers"""
+    dpd_sweep = sweep.Sweep(pa_configs=[{'noise_variance': 0}, {'noise_variance': 0.01}],
+                            dpd_grid={'order': [1, 5], 'memory_depth': [1]}, n_subcarriers=[300],
+                            n_symbols=2, max_workers=2)
+    results = dpd_sweep.run()
+    assert results.shape == (4,)
+    assert results['pa_index'].tolist() == [0, 0, 1, 1]
+    assert results['order'].tolist() == [1, 5, 1, 5]
+    assert np.all(results['nmse'][1::2] < results['nmse'][::2])
+    dpd_sweep.max_workers = 1
+    assert np.array_equal(dpd_sweep.run(), results)
+
+
+def test_batched_metrics():
+    """Welch PSD, ACLR, NMSE, and EVM should score each row of a batch"""
+    ofdm = mods.OFDM(n_subcarriers=300)
+    x = ofdm.use(n_symbols=8)
+    pa = analog.PowerAmp(noise_variance=0, add_iq_imbalance=False, add_lo_leakage=False)
+    batch = np.stack((x, pa.transmit(20 * x) / 20))
+
+    frequencies, psd = metrics.welch_psd(batch, ofdm.sampling_rate, nperseg=256)
+    assert psd.shape == (2, 256)
+    assert np.isclose(metrics.band_power(frequencies, psd, -np.inf, np.inf)[0], np.mean(np.abs(x)**2), rtol=0.05)
+
+    aclr = metrics.aclr(batch, ofdm)
+    assert aclr.shape == (2, 2)
+    assert np.all(aclr[0] < aclr[1])
+
+    assert metrics.nmse(batch, batch).tolist() == [0, 0]
+    assert np.isclose(metrics.nmse(batch[0], 2 * batch[0]), 1)
+    grids = np.stack((ofdm.fd_symbols, 1.1 * ofdm.fd_symbols))
+    assert np.allclose(metrics.evm(ofdm.fd_symbols, grids, axis=(-2, -1)), [0, 10])
+
+
 def test_freq_shift():
     """ Test the frequency shift. A 1 MHz signal shifted by 1 MHz should be a 2 MHz signal"""
     sampling_rate = 20e6  # 20 MHz
@@ -96,3 +488,218 @@ def test_freq_shift():
     two_mhz_sin = np.exp(2*np.pi*1j*(2*sin_freq)*t_array)
     error = np.square(np.abs(two_mhz_sin - y)).mean()
     assert error < 1e-20
+
+
+def test_nco_is_phase_continuous_across_blocks():
+    """Mixing block by block should match shifting the whole signal at once"""
+    sampling_rate = 30.72e6
+    x = np.exp(2*np.pi*1j*1e6*np.arange(5000)/sampling_rate).astype(np.complex64)
+    expected = x * np.exp(2*np.pi*1j*np.arange(x.size)*2.5e6/sampling_rate)
+    nco = dsp.NCO(2.5e6, sampling_rate, sub_block_size=64)
+    y = np.concatenate([nco.mix(block) for block in np.array_split(x, 7)])
+    assert np.allclose(y, expected, atol=1e-9)
+
+    nco.reset()
+    in_place = x.copy()
+    for block in dsp.iterate_blocks(in_place, 999):
+        nco.mix(block, out=block)
+    assert np.allclose(in_place, expected, atol=1e-6)
+
+    # A batch is mixed along the last axis with every row starting from the same phase
+    nco.reset()
+    batch = np.stack((x, 2 * x))
+    y = np.concatenate([nco.mix(block) for block in np.array_split(batch, 7, axis=-1)], axis=-1)
+    assert y.shape == batch.shape
+    assert np.allclose(y, np.stack((expected, 2 * expected)), atol=1e-9)
+    assert np.allclose(dsp.frequency_shift(batch, 2.5e6, sampling_rate), y, atol=1e-9)
+
+
+def test_streaming_resampler():
+    """Resampling block by block should match one call and keep a tone at the right frequency"""
+    tone = np.exp(2*np.pi*1j*0.1*np.arange(3000))
+    resampler = dsp.Resampler(6, 4)
+    expected = resampler.process(np.stack((tone, 2 * tone)))
+    resampler.reset()
+    blocks = [resampler.process(block) for block in np.array_split(np.stack((tone, 2 * tone)), [5, 6, 1000], axis=1)]
+    assert np.array_equal(np.concatenate(blocks, axis=1), expected)
+    assert expected.shape == (2, 4500)
+    steady_state = expected[0, 100:-100]
+    assert np.allclose(np.abs(steady_state), 1, atol=1e-3)
+    assert np.isclose(np.fft.fftfreq(steady_state.size)[np.argmax(np.abs(np.fft.fft(steady_state)))], 0.1 / 1.5,
+                      atol=1e-3)
+
+
+def test_carrier_aggregation_places_carriers_at_offsets():
+    """Each carrier should show up at its offset in the wideband waveform, independent of block size"""
+    carriers = [mods.OFDM(n_subcarriers=300, seed=1), mods.OFDM(n_subcarriers=600, seed=2),
+                mods.OFDM(n_subcarriers=300, seed=3)]
+    builder = mods.CarrierAggregation(carriers, [-8e6, 2e6, 10e6], sampling_rate=30.72e6)
+    x = builder.use(40000, block_size=4096)
+    assert np.array_equal(x, builder.use(40000, block_size=10000))
+
+    frequencies, psd = metrics.welch_psd(x, builder.sampling_rate, nperseg=512)
+    gap_power = metrics.band_power(frequencies, psd, -5e6, -3e6)
+    for offset, carrier in zip(builder.offsets, carriers):
+        half_bandwidth = 0.4 * carrier.n_subcarriers * carrier.subcarrier_spacing
+        carrier_power = metrics.band_power(frequencies, psd, offset - half_bandwidth, offset + half_bandwidth)
+        assert carrier_power > 1000 * gap_power
+
+
+def test_batched_precoders():
+    """ZF should null interference on every subcarrier, MMSE should approach it at low noise"""
+    random_state = np.random.RandomState(0)
+    n_subcarriers, n_users, n_antennas = 12, 4, 16
+    shape = (n_subcarriers, n_users, n_antennas)
+    channel = random_state.randn(*shape) + 1j*random_state.randn(*shape)
+    zf = precoders.ZeroForcing(channel)
+    assert zf.precoding_matrix.shape == (n_subcarriers, n_antennas, n_users)
+    effective_channel = np.matmul(channel, zf.precoding_matrix)
+    for subcarrier in effective_channel:
+        assert np.allclose(subcarrier, subcarrier[0, 0] * np.identity(n_users))
+    assert np.allclose(np.linalg.norm(zf.precoding_matrix, axis=(-2, -1)), 1)
+
+    mmse = precoders.MMSE(channel, noise_variance=1e-9)
+    assert np.allclose(mmse.precoding_matrix, zf.precoding_matrix, atol=1e-6)
+    mrt = precoders.MaximumRatio(channel, normalize=False)
+    assert np.allclose(mrt.precoding_matrix, channel.conj().swapaxes(-2, -1))
+
+    symbols = random_state.randn(n_subcarriers, n_users, 3)
+    antenna_signals = zf.precode(symbols)
+    assert antenna_signals.shape == (n_subcarriers, n_antennas, 3)
+    assert np.allclose(zf.precode(symbols[..., 0]), antenna_signals[..., 0])
+
+
+def test_gauss_markov_channel_aging():
+    """The AR(1) channel should keep unit power and decorrelate by the correlation per update"""
+    channel = channels.GaussMarkovChannel(n_users=4, n_antennas=16, n_subcarriers=600, correlation=0.8, seed=0)
+    start = channel.matrix.copy()
+    channel.update_channel()
+    lag_correlation = np.vdot(start, channel.matrix) / start.size
+    assert abs(lag_correlation - 0.8) < 0.02
+    for _ in range(20):
+        channel.update_channel()
+    assert abs(np.mean(np.abs(channel.matrix)**2) - 1) < 0.05
+
+
+def test_tapped_delay_line_channel_response():
+    """The frequency response should match the zero-padded FFT of the taps on every subcarrier"""
+    channel = channels.TappedDelayLineChannel(n_users=2, n_antennas=4, n_subcarriers=72, n_taps=5, seed=1)
+    channel.update_channel()
+    bins = mods.OFDM.map_subcarriers(72, channel.fft_size)
+    scaled_taps = channel.tap_scales[:, np.newaxis, np.newaxis] * channel.taps
+    expected = np.fft.fft(scaled_taps, n=channel.fft_size, axis=0)[bins]
+    assert channel.matrix.shape == (72, 2, 4)
+    assert np.allclose(channel.matrix, expected)
+
+    zf = precoders.ZeroForcing(channel.matrix, normalize=False)
+    symbols = np.ones((72, 2, 3))
+    received = channel.apply(zf.precode(symbols))
+    assert received.shape == (72, 2, 3)
+    assert np.allclose(received, symbols)
+    assert np.allclose(channel.apply(zf.precode(symbols[..., 0])), symbols[..., 0])
+
+
+def test_update_scheduler_matches_simpy_processes():
+    """Batching the symbols between updates should give the same output as the simpy event loop"""
+    simpy = pytest.importorskip('simpy')
+    n_subcarriers, n_users, n_antennas, n_symbols = 24, 2, 8, 20
+    symbols = np.random.RandomState(0).randn(n_subcarriers, n_users, n_symbols)
+
+    channel = channels.GaussMarkovChannel(n_users, n_antennas, n_subcarriers, update_rate=3, seed=2)
+    tx = mimo.MimoTransmitter(n_antennas, n_users, update_precoder_frequency=7)
+    scheduler = mimo.UpdateScheduler(tx, channel)
+    timeline = scheduler.update_timeline(n_symbols)
+    assert timeline['start'].tolist() == [0, 3, 6, 7, 9, 12, 14, 15, 18]
+    assert timeline['update_precoder'].tolist() == [True, False, False, True, False, False, True, False, False]
+    received = scheduler.run(symbols)
+
+    channel = channels.GaussMarkovChannel(n_users, n_antennas, n_subcarriers, update_rate=3, seed=2)
+    tx = mimo.MimoTransmitter(n_antennas, n_users, update_precoder_frequency=7)
+    expected = np.empty_like(received)
+
+    def send_symbols(env):
+        yield env.timeout(0.5)
+        for n in range(n_symbols):
+            expected[..., n] = channel.apply(tx.transmit(symbols[..., n]))
+            yield env.timeout(1)
+
+    env = simpy.Environment()
+    env.process(channel.channel_update_process(env))
+    env.process(tx.precoder.precode_update_process(env, channel))
+    env.process(send_symbols(env))
+    env.run(until=n_symbols)
+    assert np.allclose(received, expected)
+
+
+@pytest.mark.parametrize('precoder', ['zero_forcing', 'mmse'])
+def test_incremental_precoder_tracks_exact_precoder(precoder):
+    """Warm started updates should match exact recomputation and only fall back on large drift"""
+    channel = channels.GaussMarkovChannel(n_users=4, n_antennas=16, n_subcarriers=48, correlation=0.999, seed=3)
+    exact = mimo.PRECODERS[precoder](channel.matrix)
+    incremental = mimo.PRECODERS[precoder](channel.matrix, incremental=True, n_iterations=4)
+    assert incremental.n_exact == 48
+    for _ in range(5):
+        channel.update_channel()
+        exact.create_precoder_matrix(channel.matrix)
+        incremental.create_precoder_matrix(channel.matrix)
+        assert incremental.n_exact == 0
+        assert np.allclose(incremental.precoding_matrix, exact.precoding_matrix)
+
+    channel = channels.GaussMarkovChannel(n_users=4, n_antennas=16, n_subcarriers=48, seed=4)
+    exact.create_precoder_matrix(channel.matrix)
+    incremental.create_precoder_matrix(channel.matrix)
+    assert incremental.n_exact > 0
+    assert np.allclose(incremental.precoding_matrix, exact.precoding_matrix)
+
+
+def test_incremental_precoder_inverts_diverging_subcarriers_exactly():
+    """Subcarriers whose starting residual is at least 1 are inverted exactly, closer ones are refined"""
+    channel = channels.GaussMarkovChannel(n_users=4, n_antennas=16, n_subcarriers=48, seed=5)
+    incremental = precoders.ZeroForcing(channel.matrix, incremental=True, n_iterations=4)
+    for scale, n_exact in [(1.05, 0), (2, 48)]:
+        incremental.create_precoder_matrix(scale * channel.matrix)
+        assert incremental.n_exact == n_exact
+        assert np.allclose(incremental.precoding_matrix, precoders.ZeroForcing(scale * channel.matrix).precoding_matrix)
+
+
+@pytest.mark.parametrize('basis', ['odd', 'full', 'orthogonal'])
+def test_gain_lookup_table_matches_polynomial(basis):
+    """Fine tables should reproduce the polynomial they were compiled from, sample for sample"""
+    x = (np.random.RandomState(0).randn(5000) + 1j*np.random.RandomState(1).randn(5000)) / 4
+    poly = structures.MemoryPolynomial(order=5, memory_depth=3, memory_stride=2, basis=basis,
+                                       envelope_scale=np.max(np.abs(x)))
+    poly.coeffs = np.zeros(poly.coeffs.shape, dtype=complex)
+    poly.coeffs[0, 0] = 1
+    poly.coeffs[1:] = 0.05 * (np.random.RandomState(2).randn(*poly.coeffs[1:].shape) - 0.5j)
+
+    lut = structures.GainLookupTable(poly, n_entries=1024, max_amplitude=poly.envelope_scale)
+    report = lut.approximation_error(x)
+    assert report['nmse'] < 1e-8 and report['clipped_fraction'] == 0
+    amplitudes = np.linspace(0, lut.max_amplitude, 7)
+    assert np.allclose(lut.lookup(amplitudes), lut.gains(amplitudes), atol=1e-4)
+    assert np.array_equal(np.concatenate([lut.transmit_block(block) for block in np.split(x, 10)]), lut.transmit(x))
+
+    power_indexed = structures.GainLookupTable(poly, n_entries=1024, max_amplitude=poly.envelope_scale,
+                                               indexing='power')
+    assert power_indexed.approximation_error(x)['nmse'] < 1e-6
+
+    # Coarse, nearest entry, fixed point tables are worse but still close
+    coarse = structures.GainLookupTable(poly, n_entries=64, max_amplitude=poly.envelope_scale, interpolate=False,
+                                        table_bits=10)
+    assert report['nmse'] < coarse.approximation_error(x)['nmse'] < 1e-3
+
+    with pytest.raises(Exception):
+        structures.GainLookupTable(structures.MemoryPolynomial(cross_terms=1))
+
+
+def test_gain_lookup_table_of_power_amp():
+    """A PA's table should include its IQ imbalance and be scored against the noise-free PA"""
+    x = (np.random.RandomState(0).randn(5000) + 1j*np.random.RandomState(1).randn(5000)) / 4
+    pa = analog.PowerAmp(noise_variance=0.05)
+    lut = structures.GainLookupTable(pa, n_entries=1024, max_amplitude=1.5)
+    report = lut.approximation_error(x)
+    assert report['nmse'] < 1e-8 and report['clipped_fraction'] == 0
+
+    noise_free = analog.PowerAmp(noise_variance=0)
+    assert np.allclose(lut.transmit(x), noise_free.transmit(x), atol=1e-4)
+    assert np.array_equal(np.concatenate([lut.transmit_block(block) for block in np.split(x, 10)]), lut.transmit(x))